@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from argparse import ArgumentParser
+from pathlib import Path
+from json import dumps, loads
+from random import Random
+from sys import platform, version
+from time import perf_counter, process_time, strftime
+from os import open as os_open, close, fsync, O_RDONLY
+try:
+	from os import posix_fadvise, POSIX_FADV_DONTNEED
+except ImportError:
+	posix_fadvise = None
+from engine import Engine
+
+class Benchmark:
+	'''Measure throughput of the engine on generated image files'''
+
+	def __init__(self, directory, size=0x40000000):
+		'''Set directory for the image files and their size in bytes'''
+		self._dir_path = Path(directory)
+		self._size = size
+
+	def create_image(self, value=0, dirty=0, blocksize=4096, seed=0):
+		'''Create fully allocated image, fraction of blocks given by dirty contains random bytes'''
+		path = self._dir_path / f'bench_{self._size}_{value:02x}_{dirty}_{blocksize}.img'
+		chunk = bytes([value]) * 0x100000
+		with path.open('wb') as fh:
+			for offset in range(0, self._size, len(chunk)):
+				fh.write(chunk[:self._size-offset])
+			if dirty > 0:
+				rng = Random(seed)
+				blocks = self._size // blocksize
+				for block_no in rng.sample(range(blocks), int(blocks * dirty)):
+					fh.seek(block_no * blocksize)
+					fh.write(rng.randbytes(blocksize))
+		return path
+
+	@staticmethod
+	def drop_cache(path):
+		'''Write back and drop cached pages of the image file if the platform allows it'''
+		fd = os_open(path, O_RDONLY)
+		try:
+			fsync(fd)
+			if posix_fadvise:
+				posix_fadvise(fd, 0, 0, POSIX_FADV_DONTNEED)
+		except OSError:
+			pass
+		close(fd)
+
+	def run(self, task='selective', value=0, blocksize=4096, transfersize=Engine.TRANSFERSIZE, dirty=0):
+		'''Run one benchmark and return result as dict'''
+		path = self.create_image(value=value, dirty=dirty, blocksize=blocksize)
+		self.drop_cache(path)
+		passes = list()
+		engine = Engine(path, task=task, value=value, blocksize=blocksize, maxbadblocks=self._size,
+			transfersize = transfersize,
+			echo = lambda *args, **kwargs: None,
+			progress = lambda progress: passes.append(progress) if progress.final else None
+		)
+		start_time = perf_counter()
+		start_cpu = process_time()
+		engine.run()
+		seconds = perf_counter() - start_time
+		cpu = process_time() - start_cpu
+		path.unlink()
+		gigabytes = (engine.read_bytes + engine.written_bytes) / 1000000000	# counted by the engine, passes may not touch every block
+		return {
+			'time': strftime('%Y-%m-%d %H:%M:%S'),
+			'platform': platform,
+			'python': version.split()[0],
+			'task': task,
+			'value': f'{value:02x}',
+			'blocksize': blocksize,
+			'transfersize': transfersize,
+			'tuned': engine.transfersize,
+			'dirty': dirty,
+			'size': self._size,
+			'passes': len(passes),
+			'read_bytes': engine.read_bytes,
+			'written_bytes': engine.written_bytes,
+			'seconds': round(seconds, 3),
+			'mb_per_s': round(gigabytes * 1000 / seconds, 1) if seconds > 0 else None,
+			'pass_mb_per_s': [round(progress.average / 1000000, 1) for progress in passes],
+			'syscalls_per_gb': round((engine.reads + engine.writes) / gigabytes) if gigabytes else None,
+			'cpu_seconds': round(cpu, 3),
+			'cpu_per_gb': round(cpu / gigabytes, 3) if gigabytes else None,
+			'badblocks': engine.badblocks.total
+		}
+
+	@staticmethod
+	def key(result):
+		'''Parameters that make results comparable'''
+		return (result['task'], result['value'], result['blocksize'], result['transfersize'], result['dirty'], result['size'])
+
+def main():
+	'''Command line interface'''
+	argparser = ArgumentParser(description='Benchmark the wipe engine on generated image files')
+	argparser.add_argument('-b', '--blocksize', type=int, nargs='+', default=[4096],
+		help='Block sizes to test (default: 4096)', metavar='INTEGER'
+	)
+	argparser.add_argument('-c', '--compare', type=Path,
+		help='Compare with results of a previous run (JSON lines)', metavar='FILE'
+	)
+	argparser.add_argument('-d', '--dirty', type=float, nargs='+', default=[0, 0.02, 0.5],
+		help='Fractions of dirty blocks (default: 0 0.02 0.5)', metavar='FLOAT'
+	)
+	argparser.add_argument('-f', '--value', type=lambda arg: int(arg, 16), nargs='+', default=[0],
+		help='Values to wipe with in hex (default: 00)', metavar='HEX'
+	)
+	argparser.add_argument('-o', '--output', type=Path,
+		help='Append results to this file (JSON lines)', metavar='FILE'
+	)
+	argparser.add_argument('-s', '--size', type=int, default=256,
+		help='Size of the image files in MiB (default: 256)', metavar='INTEGER'
+	)
+	argparser.add_argument('-t', '--task', nargs='+', choices=Engine.TASKS, default=list(Engine.TASKS),
+		help='Tasks to run (default: all)'
+	)
+	argparser.add_argument('-x', '--transfersize', type=int, nargs='+', default=[Engine.TRANSFERSIZE],
+		help=f'Transfer sizes to test, 0 to auto-tune (default: {Engine.TRANSFERSIZE})', metavar='INTEGER'
+	)
+	argparser.add_argument('directory', nargs='?', type=Path, default=Path('.'),
+		help='Directory to create the image files in (default: current directory)'
+	)
+	args = argparser.parse_args()
+	previous = dict()
+	if args.compare:
+		for line in args.compare.read_text(encoding='utf-8').splitlines():
+			if line.strip():
+				result = loads(line)
+				previous[Benchmark.key(result)] = result
+	benchmark = Benchmark(args.directory, size=args.size * 0x100000)
+	print(f'{"task":<10} {"value":>5} {"blocksize":>9} {"transfer":>9} {"dirty":>6} {"MB/s":>9} {"calls/GB":>10} {"cpu s/GB":>9}  compared')
+	for task in args.task:
+		for value in args.value:
+			for blocksize in args.blocksize:
+				for transfersize in args.transfersize:
+					for dirty in args.dirty if task in ('selective', 'verify', 'sample') else [0]:
+						result = benchmark.run(task=task, value=value, blocksize=blocksize, transfersize=transfersize, dirty=dirty)
+						compared = ''
+						if (old := previous.get(Benchmark.key(result))) and old['mb_per_s']:
+							compared = f'{100 * result["mb_per_s"] / old["mb_per_s"]:.0f}%'
+						print(f'{task:<10} {result["value"]:>5} {blocksize:>9} {result["tuned"]:>9} {dirty:>6} {result["mb_per_s"]:>9} '
+							f'{result["syscalls_per_gb"]:>10} {result["cpu_per_gb"]:>9}  {compared}'
+						)
+						if args.output:
+							with args.output.open('a', encoding='utf-8') as fh:
+								print(dumps(result), file=fh)
+
+if __name__ == '__main__':	# start here when run as application
+	main()
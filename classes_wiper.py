@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from sys import platform
+from os import listdir, stat, major, minor
+from os.path import join as path_join, realpath, basename, isfile, isdir, exists, splitdrive
+from stat import S_ISBLK
+from re import findall, search, sub
 from json import load, dump
-from subprocess import Popen, PIPE, STDOUT, STARTUPINFO, STARTF_USESHOWWINDOW
-from wmi import WMI
+from subprocess import Popen, PIPE, STDOUT
+if platform == 'win32':
+	from subprocess import STARTUPINFO, STARTF_USESHOWWINDOW
 
 class Config:
 	'''Handle configuration file in JSON format'''
@@ -21,6 +27,17 @@ class Config:
 		'''Check if key exists'''
 		return key in self._keys
 
+	def get(self, key, default=None):
+		'''Get value of key or default if key does not exist'''
+		return self.__dict__[key] if key in self._keys else default
+
+	def update(self, values):
+		'''Set values from dict, new keys are added'''
+		for key, value in values.items():
+			self.__dict__[key] = value
+			if key not in self._keys:
+				self._keys.append(key)
+
 	def save(self, path=None):
 		'''Save config file'''
 		if path:
@@ -71,6 +88,232 @@ class WinPopen(Popen):
 			startupinfo = startupinfo
 		)
 
+class Topology:
+	'''Snapshot of physical drives, partitions and logical drives with indexes in both directions'''
+
+	DISK_ATTRS = (
+		'Caption',
+		'Description',
+		'Size',
+		'InterfaceType',
+		'MediaType',
+		'Manufacturer',
+		'Model',
+		'Name',
+		'SerialNumber',
+		'FirmwareRevision',
+		'SCSIPort'
+	)
+
+	def __init__(self, conn):
+		'''Enumerate every WMI class only once'''
+		self.disks = dict()	# PHYSICALDRIVE: infos
+		for drive in conn.Win32_DiskDrive():
+			self.disks[drive.DeviceID] = dict()
+			for attr in self.DISK_ATTRS:
+				try:
+					value = getattr(drive, attr)
+					if attr == 'Size' and value is not None:
+						self.disks[drive.DeviceID][attr] = Size(value)
+					else:
+						self.disks[drive.DeviceID][attr] = value
+				except (AttributeError, TypeError):
+					self.disks[drive.DeviceID][attr] = None
+			try:	# WMI reports NVMe drives as SCSI, their plug and play id tells
+				nvme = 'NVME' in (drive.PNPDeviceID or '').upper()
+			except AttributeError:
+				nvme = False
+			self.disks[drive.DeviceID]['BusType'] = 'NVMe' if nvme else self.disks[drive.DeviceID]['InterfaceType']
+		self.logical = dict()	# LOGICALDRIVE: infos
+		for log_disk in conn.Win32_LogicalDisk():
+			self.logical[log_disk.DeviceID] = dict()
+			try:
+				self.logical[log_disk.DeviceID]['VolumeName'] = log_disk.VolumeName
+			except AttributeError:
+				self.logical[log_disk.DeviceID]['VolumeName'] = ''
+			try:
+				self.logical[log_disk.DeviceID]['FileSystem'] = log_disk.FileSystem
+			except AttributeError:
+				self.logical[log_disk.DeviceID]['FileSystem'] = ''
+			try:
+				self.logical[log_disk.DeviceID]['Size'] = Size(log_disk.Size)
+			except TypeError:
+				self.logical[log_disk.DeviceID]['Size'] = None
+		self.disk_of = dict()		# partition: PHYSICALDRIVE
+		self.partitions_of = dict()	# PHYSICALDRIVE: partitions
+		for rel in conn.Win32_DiskDriveToDiskPartition():
+			disk_id = rel.Antecedent.DeviceID
+			part_id = rel.Dependent.DeviceID
+			self.disk_of[part_id] = disk_id
+			self.partitions_of.setdefault(disk_id, set()).add(part_id)
+		self.partition_of = dict()	# LOGICALDRIVE: partition
+		self.logical_of = dict()	# partition: LOGICALDRIVEs
+		for rel in conn.Win32_LogicalDiskToPartition():
+			part_id = rel.Antecedent.DeviceID
+			log_id = rel.Dependent.DeviceID
+			self.partition_of[log_id] = part_id
+			self.logical_of.setdefault(part_id, set()).add(log_id)
+
+	def parent_of(self, device_id):
+		'''Return physical drive of logical drive or None'''
+		return self.disk_of.get(self.partition_of.get(device_id))
+
+	def children_of(self, device_id):
+		'''Return logical drives of physical drive'''
+		return {log_id
+			for part_id in self.partitions_of.get(device_id, ())
+			for log_id in self.logical_of.get(part_id, ())
+		}
+
+class SysfsTopology(Topology):
+	'''Snapshot of block devices on Linux, reads /proc/partitions, /proc/mounts and /sys/block once'''
+
+	def __init__(self, root='/'):
+		'''Root is the directory containing sys, proc and dev, to use a copy or a fake tree'''
+		self._root = root
+		self.disks = dict()
+		self.logical = dict()
+		self.disk_of = dict()
+		self.partitions_of = dict()
+		self.partition_of = dict()
+		self.logical_of = dict()
+		self.mounts = dict()	# device id: mount points, [SWAP] for swap space
+		sizes = dict()	# kernel name: bytes
+		for line in self._read('proc/partitions').splitlines()[2:]:
+			try:
+				major, minor, blocks, name = line.split()
+				sizes[name] = int(blocks) * 1024
+			except ValueError:
+				pass
+		labels = dict()	# kernel name: file system label
+		labels_path = self._path('dev/disk/by-label')
+		if isdir(labels_path):
+			for label in listdir(labels_path):
+				labels[basename(realpath(path_join(labels_path, label)))] = sub(r'\\x([0-9a-f]{2})',
+					lambda match: chr(int(match.group(1), 16)), label
+				)
+		file_systems = dict()	# kernel name: file system type
+		for line in self._read('proc/mounts').splitlines():
+			try:
+				source, mount_point, fs_type = line.split()[:3]
+			except ValueError:
+				continue
+			if not source.startswith('/dev/'):
+				continue
+			mount_point = mount_point.replace('\\040', ' ')
+			for name in self._devices(mount_point, source, sizes):
+				file_systems[name] = fs_type
+				self.mounts.setdefault(f'/dev/{name}', set()).add(mount_point)
+		for line in self._read('proc/swaps').splitlines()[1:]:
+			if fields := line.split():	# partition or swap file
+				path = fields[0].replace('\\040', ' ')
+				for name in self._devices(path, path if path.startswith('/dev/') else None, sizes):
+					self.mounts.setdefault(f'/dev/{name}', set()).add('[SWAP]')
+		for name in sorted(listdir(self._path('sys/block'))):
+			if not isdir(self._path(f'sys/block/{name}/device')):	# loop, ram, dm, md etc.
+				continue
+			device_id = f'/dev/{name}'
+			sys_path = realpath(self._path(f'sys/block/{name}'))
+			vendor = self._read(f'sys/block/{name}/device/vendor').strip()
+			model = self._read(f'sys/block/{name}/device/model').strip()
+			self.disks[device_id] = {
+				'Caption': f'{vendor} {model}'.strip() or name,
+				'Description': 'Disk drive',
+				'Size': Size(sizes[name]) if name in sizes else None,
+				'InterfaceType': (interface := self._interface(sys_path)),
+				'BusType': interface,
+				'MediaType': self._media_type(name, sys_path),
+				'Manufacturer': vendor or None,
+				'Model': model or None,
+				'Name': device_id,
+				'SerialNumber': self._serial(name),
+				'FirmwareRevision': (self._read(f'sys/block/{name}/device/firmware_rev')
+					or self._read(f'sys/block/{name}/device/rev')).strip() or None,
+				'SCSIPort': pci[-1] if (pci := findall(r'/([0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-9a-f])(?=/)', sys_path)) else None
+			}
+			parts = [part for part in listdir(self._path(f'sys/block/{name}')) if isfile(self._path(f'sys/block/{name}/{part}/partition'))]
+			if name in file_systems:	# file system without partition table
+				parts.append(name)
+			for part in parts:
+				part_id = f'/dev/{part}'
+				self.disk_of[part_id] = device_id
+				self.partitions_of.setdefault(device_id, set()).add(part_id)
+				self.partition_of[part_id] = part_id	# partitions are the logical drives
+				self.logical_of[part_id] = {part_id}
+				self.logical[part_id] = {
+					'VolumeName': labels.get(part, ''),
+					'FileSystem': file_systems.get(part, ''),
+					'Size': Size(sizes[part]) if part in sizes else None
+				}
+
+	def _path(self, path):
+		'''Path inside root'''
+		return path_join(self._root, path)
+
+	def _read(self, path):
+		'''Read text file, empty string if not readable'''
+		try:
+			with open(self._path(path), encoding='utf-8', errors='ignore') as fh:
+				return fh.read()
+		except OSError:
+			return ''
+
+	def _device_name(self, path):
+		'''Kernel name of the block device at path or of the device holding the file system of path'''
+		try:
+			status = stat(self._path(path.lstrip('/')))
+		except OSError:
+			return
+		device = status.st_rdev if S_ISBLK(status.st_mode) else status.st_dev
+		link = self._path(f'sys/dev/block/{major(device)}:{minor(device)}')
+		if exists(link):	# not for the anonymous devices of btrfs, overlayfs etc.
+			return basename(realpath(link))
+
+	def _devices(self, path, source, sizes):
+		'''Partitions or disks of mounted path, sources like /dev/root do not name the device'''
+		names = {self._device_name(path)}
+		if source:
+			names.add(basename(realpath(self._path(source.lstrip('/')))))
+		return {resolved for name in names if name in sizes for resolved in self._resolve(name)}
+
+	def _resolve(self, name):
+		'''Generate partitions or disks of device mapper and raid devices'''
+		slaves_path = self._path(f'sys/block/{name}/slaves')
+		if isdir(slaves_path) and (slaves := listdir(slaves_path)):
+			for slave in slaves:
+				yield from self._resolve(slave)
+		else:
+			yield name
+
+	def _interface(self, sys_path):
+		'''Interface type like in WMI from the path of the device'''
+		if '/usb' in sys_path:
+			return 'USB'
+		if '/nvme' in sys_path:
+			return 'NVMe'
+		if '/mmc_host/' in sys_path:
+			return 'MMC'
+		if search(r'/host\d+/', sys_path):
+			return 'SCSI'
+
+	def _media_type(self, name, sys_path):
+		'''Media type like in WMI'''
+		if self._read(f'sys/block/{name}/removable').strip() == '1':
+			return 'Removable Media'
+		if '/usb' in sys_path:
+			return 'External hard disk media'
+		return 'Fixed hard disk media'
+
+	def _serial(self, name):
+		'''Serial number from sysfs or SCSI vital product data page 0x80'''
+		if serial := self._read(f'sys/block/{name}/device/serial').strip():
+			return serial
+		try:
+			with open(self._path(f'sys/block/{name}/device/vpd_pg80'), 'rb') as fh:
+				return fh.read()[4:].decode('ascii', errors='ignore').strip() or None
+		except OSError:
+			return
+
 class Drives:
 	'''Use WMI to get infos about drives'''
 
@@ -78,10 +321,20 @@ class Drives:
 	RETRIES = 10
 	NTFS_LABEL_CHARS = r'abcdefghijklmnopqrstuvwxyz0123456789!§$%&()@-_#=[]{}€'
 	FAT_LABEL_CHARS = r'abcdefghijklmnopqrstuvwxyz0123456789!§$%&()@-_#'
+	PHYSICAL_ATTRS = ('Caption', 'MediaType', 'InterfaceType', 'Manufacturer', 'Model', 'Name', 'Size')
+	INFO_ATTRS = ('Caption', 'Description', 'Size', 'InterfaceType', 'BusType', 'MediaType', 'Manufacturer', 'Model', 'SerialNumber', 'FirmwareRevision')
 
 	def __init__(self):
-		'''Connect to API'''			
+		'''Connect to API'''
+		from wmi import WMI	# slow to import, only needed when drives are enumerated
 		self._conn = WMI()
+		self._topology = None
+
+	def snapshot(self, refresh=False):
+		'''Return topology, drives are only enumerated on first call or on refresh'''
+		if refresh or not self._topology:
+			self._topology = Topology(self._conn)
+		return self._topology
 
 	def get_occupied_volumes(self):
 		'''Get IDs of volumes that are in use'''
@@ -89,122 +342,57 @@ class Drives:
 
 	def get_logical(self):
 		'''Get logical disks'''
-		log_disks = dict()
-		for log_disk in self._conn.Win32_LogicalDisk():
-			log_disks[log_disk.DeviceID] = dict()
-			try:
-				log_disks[log_disk.DeviceID]['VolumeName'] = log_disk.VolumeName
-			except AttributeError:
-				log_disks[log_disk.DeviceID]['VolumeName'] = ''
-			try:
-				log_disks[log_disk.DeviceID]['FileSystem'] = log_disk.FileSystem
-			except AttributeError:
-				log_disks[log_disk.DeviceID]['FileSystem'] = ''
-			try:
-				log_disks[log_disk.DeviceID]['Size'] = Size(log_disk.Size)
-			except TypeError:
-				log_disks[log_disk.DeviceID]['Size'] = None
-		return log_disks
+		return {log_id: dict(info) for log_id, info in self.snapshot().logical.items()}
 
 	def get_physical(self):
 		'''Get physical disks'''
-		drives = dict()
-		for drive in self._conn.Win32_DiskDrive():
-			drives[drive.DeviceID] = dict()
-			for attr in (
-				'Caption',
-				'MediaType',
-				'InterfaceType',
-				'Manufacturer',
-				'Model',
-				'Name',
-				'Size',
-			):
-				try:
-					value = getattr(drive, attr)
-					if attr == 'Size' and value is not None:
-						drives[drive.DeviceID][attr] = Size(value)
-					else:
-						drives[drive.DeviceID][attr] = value
-				except (AttributeError, TypeError):
-					drives[drive.DeviceID][attr] = None
-		return drives
+		return {device_id: {attr: info[attr] for attr in self.PHYSICAL_ATTRS}
+			for device_id, info in self.snapshot().disks.items()
+		}
 
 	def get_drive_info(self, device_id):
 		'''Get info about given drive'''
-		for drive in self._conn.Win32_DiskDrive():
-			if drive.DeviceID == device_id:
-				info = dict()
-				for attr in (
-					'Caption',
-					'Description',
-					'Size',
-					'InterfaceType', 
-					'MediaType',
-					'Manufacturer',
-					'Model',
-					'SerialNumber',
-					'FirmwareRevision'
-				):
-					try:
-						value = getattr(drive, attr)
-						if attr == 'Size' and value is not None:
-							info[attr] = Size(value)
-						else:
-							info[attr] = value
-					except (AttributeError, TypeError):
-						info[attr] = None
-				return info
+		if info := self.snapshot().disks.get(device_id):
+			return {attr: info[attr] for attr in self.INFO_ATTRS}
+
+	def get_controllers(self):
+		'''Get controller of each physical drive as (InterfaceType, SCSIPort)'''
+		return {device_id: (info['InterfaceType'], info['SCSIPort']) for device_id, info in self.snapshot().disks.items()}
 
 	def get_parents(self):
 		'''Return dict LOGICALDRIVE: PHYSICALDRIVE'''
-		disk2part = {(rel.Antecedent.DeviceID, rel.Dependent.DeviceID)
-			for rel in self._conn.Win32_DiskDriveToDiskPartition()
-		}
-		part2logical = {(rel.Antecedent.DeviceID, rel.Dependent.DeviceID)
-			for rel in self._conn.Win32_LogicalDiskToPartition()
-		}
-		return {logical: disk
-			for disk, part_disk in disk2part
-			for part_log, logical in part2logical
-			if part_disk == part_log
-		}
+		topology = self.snapshot()
+		return {log_id: disk_id for log_id in topology.partition_of if (disk_id := topology.parent_of(log_id))}
 
 	def get_parent_of(self, device_id):
 		'''Get parent of given device'''
 		if device_id.startswith('\\\\.\\PHYSICALDRIVE'):
 			return device_id
-		try:
-			return self.get_parents()[device_id]
-		except KeyError:
-			return
+		return self.snapshot().parent_of(device_id)
 
 	def get_children_of(self, device_id):
 		'''Return logical drives / partitions of given physical drive'''
-		part2logical = {rel.Antecedent.DeviceID: rel.Dependent.DeviceID
-			for rel in self._conn.Win32_LogicalDiskToPartition()
-		}
-		return {part2logical[rel.Dependent.DeviceID] for rel in self._conn.Win32_DiskDriveToDiskPartition()
-			if rel.Antecedent.DeviceID == device_id and rel.Dependent.DeviceID in part2logical
-		}
+		return self.snapshot().children_of(device_id)
 
 	def dump(self):
 		'''Return list of all drives'''
-		parents = self.get_parents()
-		log_disks = self.get_logical()
+		topology = self.snapshot()
 		drives = dict()
 		for device_id, drive_dict in self.get_physical().items():
 			drive = {'DeviceID': device_id} | drive_dict
-			drive['Partitions'] = list()
-			for log_id, disk_id in parents.items():
-				if disk_id == device_id:
-					drive['Partitions'].append({'DeviceID': log_id} | log_disks[log_id])
+			drive['Partitions'] = [{'DeviceID': log_id} | topology.logical[log_id]
+				for log_id in sorted(topology.children_of(device_id)) if log_id in topology.logical
+			]
 			try:
-				drives[int(device_id.lstrip('\\\\.\\PHYSICALDRIVE'))] = drive
+				drives[self._order(device_id)] = drive
 			except ValueError:
 				pass
 		return [drives[i] for i in sorted(drives.keys())]
 
+	def _order(self, device_id):
+		'''Key to sort drives, raises ValueError on ids that are not physical drives'''
+		return int(device_id.lstrip('\\\\.\\PHYSICALDRIVE'))
+
 	def get_system_ids(self):
 		'''Get ids if system drives'''
 		ids = set()
@@ -214,6 +402,20 @@ class Drives:
 				ids.add(self.get_parent_of(os_drive.SystemDrive))
 		return ids
 
+	def get_volume_of(self, path):
+		'''Get logical drive holding given path'''
+		return splitdrive(realpath(path))[0]
+
+	def get_forbidden_ids(self, paths=()):
+		'''Get ids of system drives and of the drives holding the given paths'''
+		ids = self.get_system_ids()
+		for path in paths:
+			if volume_id := self.get_volume_of(path):
+				ids.add(volume_id)
+				if parent_id := self.get_parent_of(volume_id):
+					ids.add(parent_id)
+		return ids
+
 	def check_fs_label(self, label, fs):
 		'''Check if string would be a valid file system label'''
 		if fs == 'ntfs':
@@ -236,7 +438,8 @@ class Drives:
 
 	def diskpart(self, drive_id, script_path, pt='gpt', fs='ntfs', label='Volume', letter=None, echo=None):
 		'''Create partition table and partition using diskpart'''
-		script = f'select disk {drive_id.lstrip("\\\\.\\PHYSICALDRIVE")}\nclean\nconvert {pt}\n'
+		disk_no = drive_id.lstrip('\\\\.\\PHYSICALDRIVE')
+		script = f'select disk {disk_no}\nclean\nconvert {pt}\n'
 		if fs:
 			script += f'create partition primary\nformat quick fs={fs} label={label}\n'
 			if letter:
@@ -251,3 +454,53 @@ class Drives:
 		except:
 			pass
 		return proc
+
+class SysfsDrives(Drives):
+	'''Get infos about drives on Linux from sysfs and procfs'''
+
+	def __init__(self, root='/'):
+		'''Root can be set to a fake tree for testing'''
+		self._root = root
+		self._topology = None
+
+	def snapshot(self, refresh=False):
+		'''Return topology, drives are only enumerated on first call or on refresh'''
+		if refresh or not self._topology:
+			self._topology = SysfsTopology(self._root)
+		return self._topology
+
+	def get_occupied_volumes(self):
+		'''Get IDs of mounted partitions'''
+		return set(self.snapshot(refresh=True).mounts)
+
+	def get_parent_of(self, device_id):
+		'''Get parent of given device'''
+		topology = self.snapshot()
+		if device_id in topology.disks:
+			return device_id
+		return topology.parent_of(device_id)
+
+	def get_system_ids(self):
+		'''Get ids of all mounted partitions or swap and their drives'''
+		ids = set()
+		for device_id in self.snapshot(refresh=True).mounts:
+			ids.add(device_id)
+			if parent_id := self.get_parent_of(device_id):
+				ids.add(parent_id)
+		return ids
+
+	def get_volume_of(self, path):
+		'''Get partition with the longest mount point containing given path'''
+		path = realpath(path)
+		volume_id = None
+		longest = -1
+		for device_id, mount_points in self.snapshot().mounts.items():
+			for mount_point in mount_points:
+				if len(mount_point) > longest and (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')):
+					volume_id = device_id
+					longest = len(mount_point)
+		return volume_id
+
+	def _order(self, device_id):
+		'''Sort drives by length and name, so sdb comes before sdaa'''
+		return len(device_id), device_id
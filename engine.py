@@ -0,0 +1,1323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from sys import platform
+from os import open as os_open, close, fstat, fsync, lseek, read, write, urandom, cpu_count, replace
+from os import SEEK_SET, SEEK_END, O_RDONLY, O_RDWR
+from pathlib import Path
+from stat import S_ISREG
+from errno import ENXIO
+from time import time, perf_counter, strftime, localtime
+from json import dumps, loads
+from hashlib import new as new_hash
+from math import ceil, log, lcm
+from random import Random
+from threading import Lock, Event, local
+from mmap import PAGESIZE
+from ctypes import c_char, addressof
+from collections import deque
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+try:
+	from os import pread, pwrite
+except ImportError:	# windows has no positional i/o in the os module
+	pread = pwrite = None
+try:
+	from os import preadv
+except ImportError:
+	preadv = None
+try:
+	from os import posix_fadvise, POSIX_FADV_DONTNEED
+except ImportError:	# windows does not cache raw drives
+	posix_fadvise = None
+try:
+	from os import SEEK_DATA, SEEK_HOLE
+except ImportError:
+	SEEK_DATA = SEEK_HOLE = None
+if platform == 'win32':
+	from os import O_BINARY
+	from ctypes import windll, byref, c_longlong, c_ulong
+	from msvcrt import get_osfhandle
+else:
+	O_BINARY = 0
+if platform == 'linux':	# direct i/o, discard by fallocate or ioctl
+	from os import O_DIRECT
+	from ctypes import CDLL, c_int, c_longlong
+	from fcntl import ioctl
+	from struct import pack, unpack
+	fallocate = CDLL(None, use_errno=True).fallocate
+	fallocate.argtypes = (c_int, c_int, c_longlong, c_longlong)
+else:
+	O_DIRECT = fallocate = None
+
+def address(buffer):
+	'''Memory address of a writeable buffer, None for read only buffers like bytes'''
+	try:
+		return addressof(c_char.from_buffer(buffer))
+	except TypeError:
+		return
+
+def aligned_buffer(size, alignment=PAGESIZE):
+	'''Return bytearray with data aligned to alignment if size is at least alignment, smaller buffers may be misaligned'''
+	buffer = bytearray(size + alignment)
+	del buffer[:-address(buffer) % alignment]	# deleting at the front of a bytearray does not copy
+	del buffer[size:]	# copies to unaligned memory if less than half is left, i.e. size < alignment
+	return buffer
+
+class BadBlocksError(Exception):
+	'''Raised when more bad blocks than allowed are found'''
+
+class BadRanges:
+	'''Map of failed byte ranges, sorted and merged intervals for each kind of error'''
+
+	KINDS = ('read', 'write', 'diff')
+
+	def __init__(self, ranges=None):
+		'''Optionally start with ranges given as (start, end, kind)'''
+		self._starts = {kind: list() for kind in self.KINDS}
+		self._ends = {kind: list() for kind in self.KINDS}
+		self._lock = Lock()	# writes fail in background threads
+		for start, end, kind in ranges or ():
+			self.add(start, end - start, kind)
+
+	def add(self, offset, size, kind):
+		'''Add range, adjacent and overlapping ranges of the same kind are merged'''
+		end = offset + size
+		with self._lock:
+			starts = self._starts[kind]
+			ends = self._ends[kind]
+			first = bisect_left(ends, offset)	# first range that ends at or after offset
+			last = bisect_right(starts, end)	# ranges starting behind end are not touched
+			if first < last:
+				offset = min(offset, starts[first])
+				end = max(end, ends[last-1])
+			starts[first:last] = [offset]
+			ends[first:last] = [end]
+
+	def overlaps(self, offset, size, kinds=('read', 'write')):
+		'''Check if range overlaps with a known bad range of the given kinds'''
+		with self._lock:
+			for kind in kinds:
+				no = bisect_right(self._ends[kind], offset)
+				if no < len(self._starts[kind]) and self._starts[kind][no] < offset + size:
+					return True
+		return False
+
+	def __len__(self):
+		'''Number of ranges'''
+		return sum(len(starts) for starts in self._starts.values())
+
+	def __iter__(self):
+		'''Generate ranges as (start, end, kind) sorted by start'''
+		with self._lock:
+			ranges = [(start, end, kind) for kind in self.KINDS for start, end in zip(self._starts[kind], self._ends[kind])]
+		yield from sorted(ranges)
+
+	def as_list(self):
+		'''Return ranges as list of [start, end, kind] to store as JSON'''
+		return [list(bad_range) for bad_range in self]
+
+	def save(self, path, blocksize, identity=None):
+		'''Save map as JSON file with block size and identity of the target'''
+		Path(path).write_text(dumps({'identity': identity, 'blocksize': blocksize, 'ranges': self.as_list()}), encoding='utf-8')
+
+	@classmethod
+	def load(cls, path, identity=None):
+		'''Load map from JSON file, return None if file is not readable or identity does not match'''
+		try:
+			data = loads(Path(path).read_text(encoding='utf-8'))
+		except (OSError, ValueError):
+			return
+		if data.get('identity') == identity:
+			return cls(data['ranges'])
+
+	def __str__(self):
+		'''Text for the log'''
+		return ', '.join(f'{kind} {start}-{end-1}' for start, end, kind in self)
+
+class BadBlocks:
+	'''Count bad blocks as badblocks_t in zd-win, failed ranges are kept in a map over all passes'''
+
+	def __init__(self, maxbadblocks=200, maxretries=200):
+		'''Set limits'''
+		self.max = maxbadblocks
+		self.retry = maxretries
+		self.ranges = BadRanges()
+		self._lock = Lock()	# striped workers count concurrently
+		self.reset()
+
+	def reset(self):
+		'''Reset counters to 0'''
+		self.read = 0
+		self.write = 0
+		self.diff = 0
+
+	def count(self, kind, number=1):
+		'''Add to the counter of read, write or diff errors and check the limit'''
+		with self._lock:
+			setattr(self, kind, getattr(self, kind) + number)
+		self.check()
+
+	@property
+	def total(self):
+		'''Sum of all bad blocks'''
+		return self.read + self.write + self.diff
+
+	def check(self):
+		'''Raise exception on too many bad blocks'''
+		if self.total > self.max:
+			raise BadBlocksError(
+				f'{self.write} write error(s), {self.read} read error(s), {self.diff} unwiped block(s), {self.max+1} total, aborting!'
+			)
+
+	def __str__(self):
+		'''Text as printed by zd-win'''
+		return f'{self.total} bad blocks: {self.write} write error(s), {self.read} read error(s), {self.diff} unwiped block(s)'
+
+def format_time(seconds):
+	'''Readable time span as printed by zd-win'''
+	seconds = int(seconds)
+	hours, seconds = divmod(seconds, 3600)
+	minutes, seconds = divmod(seconds, 60)
+	msg = ''
+	if hours == 1:
+		msg += '1 hour, '
+	elif hours > 1:
+		msg += f'{hours} hours, '
+	if minutes == 1:
+		msg += '1 minute, '
+	elif minutes > 1:
+		msg += f'{minutes} minutes, '
+	return msg + ('1 second' if seconds == 1 else f'{seconds} seconds')
+
+class Progress:
+	'''Progress of the running pass as reported by the engine'''
+
+	def __init__(self, target, task, stage, pass_no, passes, position, size, elapsed, rate, badblocks, final=False, resumed=0):
+		'''Collect values, rates are in bytes per second'''
+		self.target = target		# path of device or file
+		self.task = task			# selective, full, extra or verify
+		self.stage = stage			# wipe or verify
+		self.pass_no = pass_no		# running pass, starting with 1
+		self.passes = passes		# number of passes of the task
+		self.position = position	# bytes processed in this pass
+		self.size = size			# size of target in bytes
+		self.elapsed = elapsed		# seconds since this pass started
+		self.rate = rate			# throughput since last report
+		self.resumed = resumed		# position the pass was resumed at
+		self.average = (position - resumed) / elapsed if elapsed > 0 else 0
+		self.eta = (size - position) / self.average if self.average > 0 else None
+		self.read = badblocks.read
+		self.write = badblocks.write
+		self.diff = badblocks.diff
+		self.final = final			# True on the last report of a pass
+
+	@property
+	def percent(self):
+		'''Processed part of the target in percent'''
+		return self.position * 100 // self.size if self.size else 100
+
+	def as_dict(self):
+		'''Return all values as dict'''
+		return dict(vars(self))
+
+	def json(self):
+		'''Return JSON line'''
+		return dumps(self.as_dict())
+
+	def __str__(self):
+		'''Progress line like the one of zd-win'''
+		msg = f'... {self.percent}% / {self.position} of {self.size} bytes / {self.average/1000000:.1f} MB/s / ETA '
+		return msg + format_time(self.eta if self.eta else 0)
+
+class Target:
+	'''Device or file to wipe, accessed by positional reads and writes'''
+
+	IOCTL_DISK_GET_LENGTH_INFO = 0x7405c
+	IOCTL_DISK_DELETE_DRIVE_LAYOUT = 0x7c100
+	IOCTL_DISK_UPDATE_PROPERTIES = 0x70140
+	FALLOC_FL_KEEP_SIZE = 0x01
+	FALLOC_FL_PUNCH_HOLE = 0x02
+	BLKDISCARD = 0x1277
+	BLKSSZGET = 0x1268
+
+	def __init__(self, path, writeable=True, direct=False):
+		'''Open device or file, direct i/o bypasses the cache where the platform supports it'''
+		self.path = f'{path}'
+		self.writeable = writeable
+		self.fd = os_open(self.path, (O_RDWR if writeable else O_RDONLY) | O_BINARY)
+		self.is_file = S_ISREG(fstat(self.fd).st_mode)
+		self._lock = Lock()	# only needed without pread/pwrite
+		self._stats_lock = Lock()
+		self._local = local()	# bounce buffer of every thread for direct writes from unaligned memory
+		self.reads = self.writes = 0	# number of i/o calls for statistics
+		self.read_bytes = self.written_bytes = 0	# bytes requested by these calls
+		self.plain_discard = False	# set when a range was discarded without reading as zeros afterwards
+		self.direct_fd = None	# for aligned i/o, unaligned i/o as the tail of image files uses the buffered fd
+		try:
+			self.size = self._get_size()
+			if direct and O_DIRECT and pread:
+				self.alignment = self._get_alignment()
+				try:
+					self.direct_fd = os_open(self.path, (O_RDWR if writeable else O_RDONLY) | O_DIRECT)
+				except OSError:	# e.g. tmpfs
+					pass
+			if writeable and not self.is_file and platform == 'win32':
+				if not self._ioctl(self.IOCTL_DISK_DELETE_DRIVE_LAYOUT):
+					raise OSError(f'could not delete drive layout of {self.path}')
+		except:
+			close(self.fd)
+			raise
+
+	def _get_alignment(self):
+		'''Logical sector size of device or block size of the file system'''
+		if self.is_file:
+			return max(512, fstat(self.fd).st_blksize)
+		try:
+			return unpack('i', ioctl(self.fd, self.BLKSSZGET, pack('i', 0)))[0]
+		except OSError:
+			return PAGESIZE
+
+	def _direct(self, offset, size, buffer=None):
+		'''Return True if i/o can bypass the cache'''
+		if not self.direct_fd or offset % self.alignment or size % self.alignment:
+			return False
+		return buffer is None or (buffer_address := address(buffer)) is not None and buffer_address % self.alignment == 0
+
+	def _ioctl(self, code, out=None):
+		'''Windows DeviceIoControl without input buffer'''
+		returned = c_ulong()
+		return windll.kernel32.DeviceIoControl(get_osfhandle(self.fd), code, None, 0,
+			byref(out) if out is not None else None, 0 if out is None else 8, byref(returned), None
+		)
+
+	def _get_size(self):
+		'''Get size of file or device'''
+		size = lseek(self.fd, 0, SEEK_END)
+		if size <= 0 and not self.is_file and platform == 'win32':
+			length = c_longlong()
+			if not self._ioctl(self.IOCTL_DISK_GET_LENGTH_INFO, length):
+				raise OSError(f'could not determine size of {self.path}')
+			size = length.value
+		lseek(self.fd, 0, SEEK_SET)
+		return size
+
+	def read(self, offset, size):
+		'''Read block at offset, return None on error or short read'''
+		with self._stats_lock:
+			self.reads += 1
+			self.read_bytes += size
+		try:
+			if pread:
+				block = pread(self.fd, size, offset)
+			else:
+				with self._lock:
+					lseek(self.fd, offset, SEEK_SET)
+					block = read(self.fd, size)
+		except OSError:
+			return
+		if len(block) == size:
+			return block
+
+	def write(self, offset, block):
+		'''Write block at offset, return True on success'''
+		with self._stats_lock:
+			self.writes += 1
+			self.written_bytes += len(block)
+		try:
+			if self._direct(offset, len(block)):
+				if not self._direct(offset, len(block), block):	# copy to aligned memory
+					if len(bounce := getattr(self._local, 'buffer', b'')) < len(block):
+						bounce = self._local.buffer = aligned_buffer(len(block), self.alignment)
+					bounce[:len(block)] = block
+					block = memoryview(bounce)[:len(block)]
+				return pwrite(self.direct_fd, block, offset) == len(block)
+			if pwrite:
+				return pwrite(self.fd, block, offset) == len(block)
+			with self._lock:
+				lseek(self.fd, offset, SEEK_SET)
+				return write(self.fd, block) == len(block)
+		except OSError:
+			return False
+
+	def readinto(self, offset, buffer, size):
+		'''Read size bytes at offset into buffer, return True on success'''
+		if not preadv:
+			if (block := self.read(offset, size)) is None:
+				return False
+			buffer[:size] = block
+			return True
+		with self._stats_lock:
+			self.reads += 1
+			self.read_bytes += size
+		try:
+			return preadv(self.direct_fd if self._direct(offset, size, buffer) else self.fd, (memoryview(buffer)[:size],), offset) == size
+		except OSError:
+			return False
+
+	def data_extents(self):
+		'''Generate offset and size of allocated data, holes of sparse files are left out'''
+		if not self.is_file or SEEK_DATA is None:
+			yield 0, self.size
+			return
+		offset = 0
+		while offset < self.size:
+			try:
+				start = lseek(self.fd, offset, SEEK_DATA)
+			except OSError as ex:
+				if ex.errno != ENXIO:	# file system does not support SEEK_DATA
+					yield offset, self.size - offset
+				return		# ENXIO = only a hole is left
+			offset = min(lseek(self.fd, start, SEEK_HOLE), self.size)
+			yield start, offset - start
+
+	def sync(self):
+		'''Flush written data to the device'''
+		try:
+			fsync(self.fd)
+		except OSError:
+			pass
+
+	def discard(self, offset, size):
+		'''Punch hole into file or unmap range of device, return False if the target does not support it'''
+		if not fallocate:
+			return False
+		with self._stats_lock:
+			self.writes += 1
+		if fallocate(self.fd, self.FALLOC_FL_PUNCH_HOLE | self.FALLOC_FL_KEEP_SIZE, offset, size) == 0:
+			return True	# devices are only unmapped if they read as zeros afterwards
+		if self.is_file:
+			return False
+		try:	# plain discard, the device may return anything afterwards
+			ioctl(self.fd, self.BLKDISCARD, pack('QQ', offset, size))
+		except OSError:
+			return False
+		self.plain_discard = True
+		return True
+
+	def drop_cache(self, offset, size):
+		'''Drop range from the page cache, so it is read from the device again'''
+		if posix_fadvise:
+			try:
+				posix_fadvise(self.fd, offset, size, POSIX_FADV_DONTNEED)
+			except OSError:
+				pass
+
+	def close(self):
+		'''Flush and close target, tell windows to update the drive properties'''
+		if self.writeable:
+			self.sync()
+			if not self.is_file and platform == 'win32':
+				self._ioctl(self.IOCTL_DISK_UPDATE_PROPERTIES)
+		if self.direct_fd:
+			close(self.direct_fd)
+		close(self.fd)
+
+class Journal:
+	'''Checkpoint journal to resume an aborted run on the same target'''
+
+	def __init__(self, path, identity):
+		'''Identity is a dict that has to match to resume, e.g. model, serial number and size of the drive'''
+		self.path = Path(path)
+		self.identity = identity
+
+	def load(self, params):
+		'''Return last checkpoint if identity and parameters match, otherwise None'''
+		try:
+			state = loads(self.path.read_text(encoding='utf-8'))
+		except (OSError, ValueError):
+			return
+		if state.get('identity') == self.identity and all(state.get(key) == value for key, value in params.items()):
+			return state
+
+	def save(self, state):
+		'''Write checkpoint atomically, it is durable when this returns'''
+		tmp_path = self.path.with_name(f'{self.path.name}.tmp')
+		with tmp_path.open('w', encoding='utf-8') as fh:
+			fh.write(dumps(dict(state, identity=self.identity)))
+			fh.flush()
+			fsync(fh.fileno())
+		replace(tmp_path, self.path)
+
+	def remove(self):
+		'''Remove journal when run is finished'''
+		try:
+			self.path.unlink()
+		except FileNotFoundError:
+			pass
+
+class SkipAhead:
+	'''Skip a growing stride behind errors like ddrescue, skipped ranges are revisited at the end of the pass'''
+
+	def __init__(self, stride, max_stride, ranges=None):
+		'''Stride starts with given size and doubles on every error until max stride'''
+		self._min_stride = stride
+		self._max_stride = max(stride, max_stride)
+		self._stride = 0
+		self._until = 0		# skip everything before this offset
+		self._ranges = [tuple(skipped) for skipped in ranges or ()]	# skipped (offset, size)
+		self._lock = Lock()
+
+	def skips(self, offset, size):
+		'''Return True if chunk is to be skipped and revisited later'''
+		with self._lock:
+			if offset < self._until:
+				self._ranges.append((offset, size))
+				return True
+		return False
+
+	def failed(self, offset, size):
+		'''Skip chunk with error and the next stride'''
+		with self._lock:
+			self._ranges.append((offset, size))
+			if offset < self._until:	# was in flight when the window was set
+				return
+			self._stride = min(self._stride * 2, self._max_stride) if self._stride else self._min_stride
+			self._until = offset + size + self._stride
+
+	def succeeded(self, offset):
+		'''Reset stride when a chunk behind the skipped area was successful'''
+		if offset >= self._until:
+			self._stride = 0
+
+	def ranges(self):
+		'''Return skipped ranges sorted and merged as list of [offset, size]'''
+		merged = list()
+		with self._lock:
+			for offset, size in sorted(self._ranges):
+				if merged and merged[-1][0] + merged[-1][1] >= offset:
+					merged[-1][1] = max(merged[-1][1], offset + size - merged[-1][0])
+				else:
+					merged.append([offset, size])
+		return merged
+
+	def pending(self, offset, size):
+		'''Return True if range overlaps with a skipped range'''
+		with self._lock:
+			return any(start < offset + size and offset < start + length for start, length in self._ranges)
+
+	def pop(self):
+		'''Return and forget all skipped ranges'''
+		ranges = self.ranges()
+		with self._lock:
+			self._ranges.clear()
+			self._stride = self._until = 0
+		return ranges
+
+class Digest:
+	'''Running hash of the data a pass reads in order of the offsets, every segment of the target is hashed on its own'''
+
+	SEGMENT = 0x4000000	# stripes start at multiples, so the digest does not depend on the number of workers
+
+	def __init__(self, algorithm, buffersize, position=0):
+		'''Bytes that are not read are hashed as zeros, buffersize is used to feed them, position is the first offset'''
+		self.algorithm = algorithm
+		self.position = position
+		self.zeroed = list()	# [start, end] of ranges hashed as zeros, e.g. holes and read errors
+		self.segments = list()	# digests of the finished segments
+		self._hash = new_hash(algorithm)
+		self._zeros = memoryview(bytes(buffersize))
+
+	def _feed(self, data):
+		'''Hash data at the current position, a new segment starts at every multiple of the segment size'''
+		data = memoryview(data)
+		while data:
+			size = min(len(data), self.SEGMENT - self.position % self.SEGMENT)
+			self._hash.update(data[:size])
+			self.position += size
+			data = data[size:]
+			if self.position % self.SEGMENT == 0:
+				self.segments.append(self._hash.digest())
+				self._hash = new_hash(self.algorithm)
+
+	def _zero(self, end):
+		'''Hash zeros from current position to end'''
+		if self.zeroed and self.zeroed[-1][1] == self.position:
+			self.zeroed[-1][1] = end
+		else:
+			self.zeroed.append([self.position, end])
+		while self.position < end:
+			self._feed(self._zeros[:end - self.position])
+
+	def update(self, offset, size, chunk):
+		'''Hash chunk read at offset, None is a read error'''
+		if offset > self.position:	# skipped
+			self._zero(offset)
+		if chunk is None:
+			self._zero(offset + size)
+		else:
+			self._feed(chunk)
+
+	def finish(self, end):
+		'''Hash zeros up to end and finish the last segment'''
+		if end > self.position:
+			self._zero(end)
+		if self.position % self.SEGMENT:
+			self.segments.append(self._hash.digest())
+
+class Pipeline:
+	'''Keep multiple reads and writes in flight using pools of threads and a fixed pool of buffers'''
+
+	def __init__(self, depth, buffersize):
+		'''Queue depth is the number of reads and writes in flight'''
+		self._depth = depth
+		self._readers = ThreadPoolExecutor(max_workers=depth)
+		self._writers = ThreadPoolExecutor(max_workers=depth)
+		self._buffers = [aligned_buffer(buffersize) for buffer in range(depth + 1)]	# preallocated and aligned for direct i/o
+		self._writes = deque()
+
+	def read_ahead(self, target, chunks):
+		'''Generate offset, size and data (None on error) of the given chunks in order, next reads run ahead'''
+		chunks = iter(chunks)
+		pending = deque()
+		def submit():
+			for offset, size in chunks:
+				buffer = self._buffers.pop()
+				pending.append((offset, size, buffer, self._readers.submit(target.readinto, offset, buffer, size)))
+				return True
+			return False
+		try:
+			while len(pending) < self._depth and submit():
+				pass
+			while pending:
+				offset, size, buffer, future = pending.popleft()
+				if not future.result():
+					yield offset, size, None
+				elif size == len(buffer):
+					yield offset, size, buffer
+				else:	# last chunk, slicing copies
+					yield offset, size, buffer[:size]
+				self._buffers.append(buffer)
+				submit()
+		finally:	# wait for reads that are still running on abort
+			for offset, size, buffer, future in pending:
+				future.cancel()
+				try:
+					future.result()
+				except:
+					pass
+				self._buffers.append(buffer)
+
+	def write_behind(self, method, *args):
+		'''Run write method in the background, return results of finished writes to keep queue depth'''
+		self._writes.append(self._writers.submit(method, *args))
+		results = list()
+		while len(self._writes) > self._depth or (self._writes and self._writes[0].done()):
+			results.append(self._writes.popleft().result())
+		return results
+
+	def drain(self):
+		'''Wait for all writes and return their results'''
+		results = list()
+		while self._writes:
+			results.append(self._writes.popleft().result())
+		return results
+
+	def shutdown(self):
+		'''Stop threads'''
+		for future in self._writes:
+			future.cancel()
+		self._readers.shutdown()
+		self._writers.shutdown()
+
+class RandomStream:
+	'''Non-repeating random stream from the CSPRNG of the os, generated ahead in background threads'''
+
+	def __init__(self, workers=None):
+		'''Default is one thread per cpu on linux where getrandom releases the GIL, windows holds it in BCryptGenRandom'''
+		self.workers = workers if workers else ((cpu_count() or 1) if platform != 'win32' else 1)
+		self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+	def chunk(self, size):
+		'''Generate random bytes, the same offset gets new bytes when it is rewritten'''
+		return urandom(size)
+
+	def generate(self, chunks, ahead):
+		'''Generate offset, size and bytes of chunks in order while the next chunks are generated ahead'''
+		pending = deque()
+		try:
+			for offset, size in chunks:
+				pending.append((offset, size, self._executor.submit(self.chunk, size)))
+				if len(pending) > ahead:
+					offset, size, future = pending.popleft()
+					yield offset, size, future.result()
+			while pending:
+				offset, size, future = pending.popleft()
+				yield offset, size, future.result()
+		finally:
+			for offset, size, future in pending:
+				future.cancel()
+
+	def shutdown(self):
+		'''Stop threads'''
+		self._executor.shutdown()
+
+class Engine:
+	'''Portable wipe engine, does the same as zd-win but in process'''
+
+	TASKS = ('selective', 'full', 'extra', 'verify', 'sample')
+	TRANSFERSIZE = 0x400000		# default bytes to read or write at once
+	MAX_TRANSFERSIZE = 0x4000000
+	PROBE_TRANSFERSIZES = (0x10000, 0x40000, 0x100000, 0x400000, 0x800000)	# to auto-tune
+	PROBESIZE = 0x4000000		# bytes to read or write with each probed transfer size
+	QUEUEDEPTH = 4				# reads and writes in flight
+	METADATA_SIZE = 0x100000	# bytes at start and end of target always verified in sample mode
+	CHECKPOINT_INTERVAL = 60	# seconds inbetween checkpoints in the journal
+	MAX_SKIP = 0x40000000		# maximum stride to skip on errors
+	MERGE_GAP = 0x10000			# rewritten runs closer than this are verified at once
+	FUSED_WINDOW = 0x4000000	# bytes written before they are read back in fused mode
+	DISCARD_SIZE = 0x40000000	# bytes to discard at once
+
+	def __init__(self, path, task='selective', value=0, blocksize=4096, maxbadblocks=200, maxretries=200,
+		transfersize=TRANSFERSIZE, queuedepth=QUEUEDEPTH, confidence=0.99, dirtyfraction=0.0001, skipahead=True,
+		digest='sha256', fullverify=False, fused=False, discard=False, direct=True, workers=1, echo=print, warning=None, progress=None, kill=None, journal=None, known=None
+	):
+		'''Check and set options'''
+		if task not in self.TASKS:
+			raise ValueError(f'invalid task: {task}')
+		if value < 0 or value > 0xff:
+			raise ValueError('value has to be inbetween 0 and 0xff')
+		if blocksize < 512 or blocksize % 512 != 0:
+			raise ValueError('block size has to be n * 512 and >= 512')
+		if transfersize < 0 or transfersize > self.MAX_TRANSFERSIZE:
+			raise ValueError(f'transfer size has to be 0 (auto-tune) or <= {self.MAX_TRANSFERSIZE}')
+		if queuedepth < 1:
+			raise ValueError('queue depth has to be >= 1')
+		if workers < 1:
+			raise ValueError('number of workers has to be >= 1')
+		if not 0 < confidence < 1 or not 0 < dirtyfraction < 1:
+			raise ValueError('confidence and dirty fraction have to be > 0 and < 1')
+		if digest:
+			new_hash(digest)	# raises ValueError if the algorithm is not available
+		self.path = path
+		self.task = task
+		self.value = value
+		self.blocksize = blocksize
+		self.queuedepth = queuedepth
+		self.skipahead = skipahead		# skip ahead on errors and revisit at the end of the pass
+		self.fullverify = fullverify	# selective mode: verify every page, not only the rewritten ones
+		self.fused = fused and task in ('full', 'extra')	# read back while writing the value instead of a verify pass
+		self.discard = discard and task == 'selective'	# discard before the selective pass overwrites what is left
+		self.direct = direct	# bypass the cache where the platform supports it
+		self.workers = workers	# reading passes split the target into this number of stripes read concurrently
+		self._lock = Lock()	# for the runs rewritten by the workers
+		self.confidence = confidence		# sample mode: confidence level
+		self.dirtyfraction = dirtyfraction	# sample mode: maximum fraction of not wiped pages to detect
+		self.badblocks = BadBlocks(maxbadblocks=maxbadblocks, maxretries=maxretries)	# counters of the current pass
+		self.pass_badblocks = list()	# counters of every pass of the last run, for the report
+		self.reads = self.writes = 0	# i/o calls of the last run
+		self.read_bytes = self.written_bytes = 0	# bytes transferred in the last run
+		self.digest = None	# digest of the data read by a complete verify pass as dict
+		self._digest_algorithm = digest if task != 'sample' else None	# hashlib name or None
+		self._echo = echo		# method to show messages
+		self._warning = warning if warning else lambda msg: echo(f'Warning: {msg}')
+		self._progress_method = progress if progress else self._print_progress	# gets Progress objects
+		self._kill = kill		# event to stop wipe process
+		self._journal = journal if task != 'sample' else None	# Journal to resume aborted runs
+		self._known = known		# BadRanges of previous runs, retries are skipped there
+		self._block = bytes([value]) * blocksize	# block/page to compare
+		self.transfersize = transfersize and self._round(transfersize)	# 0 = auto-tune when target is open
+
+	def _round(self, transfersize):
+		'''Transfer size has to be a multiple of the block size'''
+		return max(self.blocksize, transfersize // self.blocksize * self.blocksize)
+
+	def _print_progress(self, progress):
+		'''Default to show progress'''
+		self._echo(f'{progress}', end='\n' if progress.final else '\r')
+
+	def _progress(self, position, final=False):
+		'''Report progress once per second'''
+		now = time()
+		if not final and now < self._next_progress:
+			return
+		self._next_progress = now + 1
+		rate = (position - self._last_position) / (now - self._last_time) if now > self._last_time else 0
+		self._last_time = now
+		self._last_position = position
+		self._progress_method(Progress(self.path, self.task, self._stage, self._pass_no, self._passes,
+			position, self._target.size, now - self._start_time, rate, self.badblocks, final=final, resumed=self._resume_offset
+		))
+
+	def _checkpoint(self, offset, force=False):
+		'''Make everything before offset durable and record it in the journal, at most once per interval'''
+		if not self._journal or (not force and time() < self._next_checkpoint):
+			return
+		if self._stage == 'wipe':
+			self._count_write_errors(self._pipeline.drain())
+			self._target.sync()
+		self._journal.save(dict(self._params,
+			pass_no = self._pass_no,
+			offset = offset,
+			read = self.badblocks.read,
+			write = self.badblocks.write,
+			diff = self.badblocks.diff,
+			ranges = self.badblocks.ranges.as_list(),
+			skipped = (self._skip.ranges() if self._skip else list()) + self._revisiting,
+			rewritten = self._rewritten,
+			plain_discard = self._plain_discard,
+			passes = self.pass_badblocks,
+			time = time()
+		))
+		self._next_checkpoint = time() + self.CHECKPOINT_INTERVAL
+
+	def _killed(self):
+		'''Check if kill signal is set'''
+		return self._kill and self._kill.is_set()
+
+	def _retries(self, offset, size):
+		'''Number of retries, none in ranges that are already known as bad'''
+		if self.badblocks.ranges.overlaps(offset, size) or (self._known and self._known.overlaps(offset, size)):
+			return 0
+		return self.badblocks.retry
+
+	def _read(self, offset, size):
+		'''Read block, retry on error and count as bad block if not possible'''
+		if block := self._target.read(offset, size):
+			return block
+		for retry in range(self._retries(offset, size)):
+			if block := self._target.read(offset, size):
+				return block
+		self.badblocks.ranges.add(offset, size, 'read')
+		self.badblocks.count('read')
+
+	def _write_retry(self, offset, block):
+		'''Write block, retry on error, return True on success'''
+		if self._target.write(offset, block):
+			return True
+		for retry in range(self._retries(offset, len(block))):
+			if self._target.write(offset, block):
+				return True
+		self.badblocks.ranges.add(offset, len(block), 'write')
+		return False
+
+	def _write_chunk(self, offset, chunk, skip=True):
+		'''Write chunk, on error skip ahead or write page by page, return number of pages that could not be written'''
+		if self._target.write(offset, chunk):
+			if self._skip:
+				self._skip.succeeded(offset)
+			return 0
+		if skip and self._skip:
+			self._skip.failed(offset, len(chunk))
+			return 0
+		chunk = memoryview(chunk)
+		return sum(1 for page_offset, page_size in self._pages(offset, len(chunk))
+			if not self._write_retry(page_offset, chunk[page_offset-offset:page_offset-offset+page_size])
+		)
+
+	def _count_write_errors(self, results):
+		'''Count pages of finished writes that could not be written'''
+		if errors := sum(results):
+			self.badblocks.count('write', errors)
+
+	def _chunks(self, chunksize, skip_holes=False):
+		'''Generate offset and size of chunks, holes of sparse files are skipped if they read as the value'''
+		if skip_holes and self.value == 0:
+			extents = self._target.data_extents()
+		else:
+			extents = ((0, self._target.size),)
+		pos = self._resume_offset
+		for start, size in extents:	# align to pages as holes are only aligned to file system blocks
+			end = min(-(-(start + size) // self.blocksize) * self.blocksize, self._target.size)
+			start = max(start // self.blocksize * self.blocksize, pos)
+			self._skipped += start - pos
+			for offset in range(start, end, chunksize):
+				yield offset, min(chunksize, end - offset)
+			pos = max(end, pos)
+		self._skipped += self._target.size - pos
+
+	def _pages(self, offset, size):
+		'''Generate offset and size of the pages in chunk'''
+		for page_offset in range(offset, offset + size, self.blocksize):
+			yield page_offset, min(self.blocksize, offset + size - page_offset)
+
+	def _dirty_runs(self, offset, size, chunk):
+		'''Return runs of adjacent pages not matching the value as (offset, size), chunk is None on read error'''
+		if chunk == self._chunk[:size]:	# fast path, the whole chunk is clean
+			return
+		runs = list()
+		run_offset = run_end = None
+		for page_offset, page_size in self._pages(offset, size):
+			if chunk is None:	# read error, check page by page
+				page = self._target.read(page_offset, page_size)
+			else:
+				page = chunk[page_offset-offset:page_offset-offset+page_size]
+			if page == self._block[:page_size]:
+				continue
+			if run_end == page_offset:
+				run_end += page_size
+			else:
+				if run_end:
+					runs.append((run_offset, run_end - run_offset))
+				run_offset, run_end = page_offset, page_offset + page_size
+		if run_end:
+			runs.append((run_offset, run_end - run_offset))
+		return runs
+
+	def _unskipped(self, chunks):
+		'''Leave out chunks in the area that is skipped behind errors'''
+		for offset, size in chunks:
+			if not self._skip or not self._skip.skips(offset, size):
+				yield offset, size
+
+	def _read_failed(self, offset, size, chunk):
+		'''Return True if chunk could not be read and is skipped to be revisited later'''
+		if not self._skip:
+			return False
+		if chunk is None:
+			self._skip.failed(offset, size)
+			return True
+		self._skip.succeeded(offset)
+		return False
+
+	def _revisit(self, method):
+		'''Process skipped ranges chunk by chunk with the given method, return False if aborted'''
+		if not self._skip or not (ranges := self._skip.pop()):
+			return True
+		self._echo(f'Revisiting {sum(size for offset, size in ranges)} bytes in {len(ranges)} skipped range(s)')
+		self._revisiting = ranges
+		while ranges:
+			offset, size = ranges[0]
+			chunk_size = min(self.transfersize, size)
+			method(offset, chunk_size)
+			if chunk_size == size:
+				ranges.pop(0)
+			else:
+				ranges[0] = [offset + chunk_size, size - chunk_size]
+			self._progress(offset)
+			if self._killed():
+				self._checkpoint(self._target.size, force=True)
+				return False
+			self._checkpoint(self._target.size)	# main sweep is done
+		return True
+
+	def _wipe_dirty_runs(self, offset, size, chunk, write):
+		'''Overwrite runs of pages that do not match the value using the given write method'''
+		for run_offset, run_size in self._dirty_runs(offset, size, chunk) or ():
+			with self._lock:
+				if self._rewritten and 0 <= run_offset - sum(self._rewritten[-1]) <= self.MERGE_GAP:
+					self._rewritten[-1][1] = run_offset + run_size - self._rewritten[-1][0]
+				else:
+					self._rewritten.append([run_offset, run_size])
+			write(run_offset, self._reference[:run_size])
+
+	def _discard(self):
+		'''Discard the whole target range by range, the selective pass overwrites pages that do not read as the value'''
+		for offset in range(self._resume_offset, self._target.size, self.DISCARD_SIZE):
+			size = min(self.DISCARD_SIZE, self._target.size - offset)
+			if not self._target.discard(offset, size):
+				self._notes.append(f'Target does not support discard, {self._target.size - offset} bytes are left to the selective pass')
+				break
+			self._plain_discard = self._plain_discard or self._target.plain_discard
+			self._progress(offset)
+			if self._killed():
+				self._checkpoint(offset + size, force=True)
+				return False
+			self._checkpoint(offset + size)
+		return True
+
+	def _striped(self, method, digest=False):
+		'''Split target into one stripe per worker, process chunks of each stripe by method in its own thread'''
+		start = self._resume_offset
+		if start >= self._target.size:	# empty target or resumed at the end
+			return True
+		unit = lcm(Digest.SEGMENT, self.blocksize)	# stripes start at segments of the digest
+		stripe_size = max(-(-(self._target.size - start) // self.workers // unit), 1) * unit
+		stripes = [(offset, min(offset + stripe_size, self._target.size)) for offset in range(start, self._target.size, stripe_size)]
+		positions = [offset for offset, end in stripes]	# next offset of every stripe
+		digests = [self._new_digest(offset) for offset, end in stripes] if digest else None
+		stop = Event()
+		def work(no):
+			buffer = aligned_buffer(self.transfersize)
+			for offset in range(*stripes[no], self.transfersize):
+				if stop.is_set():
+					return
+				size = min(self.transfersize, stripes[no][1] - offset)
+				if not self._target.readinto(offset, buffer, size):
+					chunk = None
+				elif size == len(buffer):
+					chunk = buffer
+				else:	# last chunk, slicing copies
+					chunk = buffer[:size]
+				if digests and digests[no]:
+					digests[no].update(offset, size, chunk)
+				method(offset, size, chunk)
+				positions[no] = offset + size
+		def verified():	# everything before this offset is done
+			for position, (offset, end) in zip(positions, stripes):
+				if position < end:
+					return position
+			return self._target.size
+		with ThreadPoolExecutor(max_workers=len(stripes)) as workers:
+			futures = [workers.submit(work, no) for no in range(len(stripes))]
+			while wait(futures, timeout=0.5, return_when=FIRST_EXCEPTION).not_done:
+				if any(future.done() and future.exception() for future in futures):
+					break
+				self._progress(start + sum(position - offset for position, (offset, end) in zip(positions, stripes)))
+				if self._killed():
+					break
+				self._checkpoint(verified())
+			stop.set()
+			wait(futures)
+		for future in futures:
+			future.result()	# raises BadBlocksError of the workers
+		if self._killed():
+			self._checkpoint(verified(), force=True)
+			return False
+		if digests and digests[0]:
+			for stripe_digest, (offset, end) in zip(digests, stripes):
+				stripe_digest.finish(end)
+			self._finish_digest(digests)
+		return True
+
+	def _wipe_selective(self):
+		'''Overwrite pages that do not match the value, read ahead in chunks and write adjacent pages at once'''
+		if self.workers > 1:	# write in the threads of the stripes
+			write = lambda offset, chunk: self._count_write_errors((self._write_chunk(offset, chunk, skip=False),))
+			return self._striped(lambda offset, size, chunk: self._wipe_dirty_runs(offset, size, chunk, write))
+		write_behind = lambda offset, chunk: self._count_write_errors(self._pipeline.write_behind(self._write_chunk, offset, chunk))
+		chunks = self._unskipped(self._chunks(self.transfersize, skip_holes=True))
+		for offset, size, chunk in self._pipeline.read_ahead(self._target, chunks):
+			if not self._read_failed(offset, size, chunk):
+				self._wipe_dirty_runs(offset, size, chunk, write_behind)
+			self._progress(offset)
+			if self._killed():
+				self._checkpoint(offset, force=True)
+				break
+			self._checkpoint(offset)
+		self._count_write_errors(self._pipeline.drain())
+		write = lambda offset, chunk: self._count_write_errors((self._write_chunk(offset, chunk, skip=False),))
+		return not self._killed() and self._revisit(
+			lambda offset, size: self._wipe_dirty_runs(offset, size, self._target.read(offset, size), write)
+		)
+
+	def _wipe_all(self, random=False):
+		'''Overwrite every block with the value or a random stream, writes are done in the background'''
+		if random:
+			chunks = self._random.generate(self._unskipped(self._chunks(self.transfersize)), self.queuedepth + self._random.workers)
+		else:
+			chunks = ((offset, size, self._reference[:size]) for offset, size in self._unskipped(self._chunks(self.transfersize)))
+		for offset, size, chunk in chunks:
+			self._count_write_errors(self._pipeline.write_behind(self._write_chunk, offset, chunk))
+			self._progress(offset)
+			if self._killed():
+				self._checkpoint(offset, force=True)
+				break
+			self._checkpoint(offset)
+		self._count_write_errors(self._pipeline.drain())
+		return not self._killed() and self._revisit(lambda offset, size: self._count_write_errors((self._write_chunk(offset,
+			self._random.chunk(size) if random else self._reference[:size], skip=False
+		),)))
+
+	def _read_back(self, chunks, digest=None):
+		'''Make written chunks durable, drop them from the cache and compare them with the value'''
+		self._count_write_errors(self._pipeline.drain())
+		self._target.sync()
+		if self._skip:	# chunks that failed are read back when revisited
+			chunks = [(offset, size) for offset, size in chunks if not self._skip.pending(offset, size)]
+		if not chunks:
+			return
+		self._target.drop_cache(chunks[0][0], chunks[-1][0] + chunks[-1][1] - chunks[0][0])
+		for offset, size, chunk in self._pipeline.read_ahead(self._target, chunks):
+			if digest:
+				digest.update(offset, size, chunk)
+			self._compare(offset, size, chunk)
+
+	def _wipe_fused(self):
+		'''Overwrite every block with the value and read back every window right after it is written'''
+		window = list()
+		digest = self._new_digest()
+		for offset, size in self._unskipped(self._chunks(self.transfersize)):
+			self._count_write_errors(self._pipeline.write_behind(self._write_chunk, offset, self._reference[:size]))
+			window.append((offset, size))
+			if len(window) * self.transfersize < self.FUSED_WINDOW and offset + size < self._target.size:
+				continue
+			self._read_back(window, digest)
+			window = list()
+			self._progress(offset)
+			if self._killed():
+				self._checkpoint(offset + size, force=True)
+				return False
+			self._checkpoint(offset + size)
+		self._read_back(window, digest)	# chunks left when the end of the drive is skipped
+		if digest:
+			digest.finish(self._target.size)
+			self._finish_digest((digest,))
+		def revisit(offset, size):
+			self._count_write_errors((self._write_chunk(offset, self._reference[:size], skip=False),))
+			self._read_back([(offset, size)])
+		return self._revisit(revisit)
+
+	def _compare(self, offset, size, chunk):
+		'''Compare chunk with the value, page by page only if it does not match, None is a read error'''
+		if chunk == self._chunk[:size]:
+			return
+		for page_offset, page_size in self._pages(offset, size):
+			if chunk is None:
+				page = self._read(page_offset, page_size)
+			else:
+				page = chunk[page_offset-offset:page_offset-offset+page_size]
+			if page is not None and page != self._block[:page_size]:
+				self.badblocks.ranges.add(page_offset, page_size, 'diff')
+				self.badblocks.count('diff')
+
+	def _new_digest(self, position=0):
+		'''Return Digest if the pass reads everything from the start'''
+		if self._digest_algorithm and self._resume_offset == 0:
+			return Digest(self._digest_algorithm, self.transfersize, position=position)
+
+	def _finish_digest(self, digests):
+		'''Store digest of the pass as hash of the segment digests of the given Digests in order and note it'''
+		combined = new_hash(self._digest_algorithm)
+		for digest in digests:
+			for segment in digest.segments:
+				combined.update(segment)
+		self.digest = {'algorithm': self._digest_algorithm, 'digest': combined.hexdigest(), 'segment': Digest.SEGMENT,
+			'size': self._target.size, 'zeroed': [zeroed for digest in digests for zeroed in digest.zeroed]
+		}
+		self._notes.append(f'{self.digest["algorithm"].upper()} of the verified data: {self.digest["digest"]}')
+		if self.digest['zeroed']:
+			self._notes.append(f'Hashed {sum(end - start for start, end in self.digest["zeroed"])} bytes as zeros '
+				'that were not read in order (holes, read errors or ranges skipped behind errors)'
+			)
+
+	def _verify(self, chunks=None):
+		'''Compare every block/page or given chunks with the value, read ahead and page by page only on errors'''
+		digest = None
+		if chunks is None:
+			if self.workers > 1:
+				return self._striped(self._compare, digest=True)
+			chunks = self._chunks(self.transfersize, skip_holes=True)
+			digest = self._new_digest()	# hash what is read, resumed passes do not read everything
+		for offset, size, chunk in self._pipeline.read_ahead(self._target, self._unskipped(chunks)):
+			if digest:
+				digest.update(offset, size, chunk)
+			if not self._read_failed(offset, size, chunk):
+				self._compare(offset, size, chunk)
+			self._progress(offset)
+			if self._killed():
+				self._checkpoint(offset, force=True)
+				return False
+			self._checkpoint(offset)
+		if digest:
+			digest.finish(self._target.size)
+			self._finish_digest((digest,))
+		return self._revisit(lambda offset, size: self._compare(offset, size, self._target.read(offset, size)))
+
+	def _verify_rewritten(self):
+		'''Verify only the pages the selective pass rewrote and the ranges that failed'''
+		ranges = sorted(self._rewritten + [[start, end - start] for start, end, kind in self.badblocks.ranges if kind != 'diff'])
+		merged = list()
+		for offset, size in ranges:
+			if merged and offset - sum(merged[-1]) <= self.MERGE_GAP:
+				merged[-1][1] = max(merged[-1][1], offset + size - merged[-1][0])
+			else:
+				merged.append([offset, size])
+		def chunks():
+			for offset, size in merged:
+				for chunk_offset in range(max(offset, self._resume_offset), offset + size, self.transfersize):
+					yield chunk_offset, min(self.transfersize, offset + size - chunk_offset)
+		if not self._verify(chunks()):
+			return False
+		self._notes.append(f'Verified {sum(size for offset, size in merged)} bytes in {len(merged)} range(s) '
+			'that were rewritten or failed, the selective pass has read everything else'
+		)
+		return True
+
+	def _samples(self, head, tail):
+		'''Generate chunks of the metadata regions and one random page of every stratum inbetween'''
+		for offset in range(0, head, self.transfersize):
+			yield offset, min(self.transfersize, head - offset)
+		rng = Random()
+		first_page = head // self.blocksize
+		pages = tail // self.blocksize - first_page
+		for stratum in range(self._sampled):
+			page = rng.randrange(first_page + stratum * pages // self._sampled, first_page + (stratum + 1) * pages // self._sampled)
+			yield page * self.blocksize, self.blocksize
+		for offset in range(tail, self._target.size, self.transfersize):
+			yield offset, min(self.transfersize, self._target.size - offset)
+
+	def _verify_sampled(self):
+		'''Verify stratified random pages, sample size is given by confidence level and tolerated dirty fraction'''
+		head = min(-(-self.METADATA_SIZE // self.blocksize) * self.blocksize, self._target.size)
+		tail = max(head, (self._target.size - self.METADATA_SIZE) // self.blocksize * self.blocksize)
+		pages = (tail - head) // self.blocksize
+		self._sampled = min(ceil(log(1 - self.confidence) / log(1 - self.dirtyfraction)), pages)
+		if not self._verify(self._samples(head, tail)):
+			return False
+		msg = (f'Verified {self._sampled} random pages of {pages} ({100 * self._sampled / pages if pages else 100:.3f}%)'
+			f' and {head + self._target.size - tail} bytes at start and end')
+		if self.badblocks.diff == 0:
+			if self._sampled == pages:
+				self._notes.append(f'{msg}, all pages are wiped')
+			else:
+				self._notes.append(f'{msg}, {100 * self.confidence:g}% confidence that less than '
+					f'{100 * self.dirtyfraction:g}% of the pages are not wiped'
+				)
+		else:
+			self._notes.append(f'{msg}, found {self.badblocks.diff} page(s) that are not wiped')
+		return True
+
+	def _autotune(self):
+		'''Probe sequential throughput at different transfer sizes and return the fastest'''
+		transfersizes = sorted({self._round(transfersize) for transfersize in self.PROBE_TRANSFERSIZES})
+		probesize = min(self.PROBESIZE, self._target.size // len(transfersizes))
+		probesize -= probesize % transfersizes[-1]
+		if probesize == 0:	# target is too small
+			return self._round(self.TRANSFERSIZE)
+		writing = self.task in ('full', 'extra')	# these overwrite anything, so writes can be probed
+		rates = dict()
+		for no, transfersize in enumerate(transfersizes):
+			chunk = bytes([self.value]) * transfersize
+			start_time = perf_counter()
+			for offset in range(no * probesize, (no + 1) * probesize, transfersize):
+				if writing:
+					if not self._target.write(offset, chunk):
+						break
+				elif self._target.read(offset, transfersize) is None:
+					break
+			else:
+				if writing:
+					self._target.sync()
+				rates[transfersize] = probesize / (perf_counter() - start_time)
+			if self._killed():
+				break
+		if not rates:
+			return self._round(self.TRANSFERSIZE)
+		transfersize = max(rates, key=rates.get)
+		self._echo(f'Auto-tuned transfer size: {transfersize} bytes, probed {"writing" if writing else "reading"} '
+			+ ', '.join(f'{size}: {rate/1000000:.1f} MB/s' for size, rate in rates.items())
+		)
+		return transfersize
+
+	def _pass(self, pass_no, passes, method, *args, resume=None):
+		'''Run one pass, return False if aborted, resume is the checkpoint to continue at'''
+		self._stage = 'verify' if method in (self._verify, self._verify_sampled, self._verify_rewritten) else 'wipe'
+		self._pass_no = pass_no
+		self._passes = passes
+		if method == self._wipe_fused:
+			action = 'Wiping and verifying'
+		elif method == self._discard:
+			action = 'Discarding'
+		else:
+			action = 'Verifying' if self._stage == 'verify' else 'Wiping'
+		if passes == 1:
+			self._echo(action)
+		else:
+			self._echo(f'{action}, pass {pass_no} of {passes}')
+		self._start_time = self._last_time = time()
+		self._next_progress = 0
+		self._next_checkpoint = self._start_time + self.CHECKPOINT_INTERVAL
+		self._skipped = 0
+		self._notes = list()	# messages to show after the pass
+		self._skip = SkipAhead(self.transfersize, self.MAX_SKIP, resume.get('skipped') if resume else None) if self.skipahead else None
+		self._revisiting = list()	# skipped ranges left to revisit
+		self.badblocks.reset()
+		if resume:
+			self._resume_offset = resume['offset']
+			self.badblocks.read = resume['read']
+			self.badblocks.write = resume['write']
+			self.badblocks.diff = resume['diff']
+			self._echo(f'Resuming at {self._resume_offset} of {self._target.size} bytes')
+		else:
+			self._resume_offset = 0
+		self._last_position = self._resume_offset
+		try:
+			if not method(*args):
+				return False
+		finally:	# also aborted passes and passes with too many bad blocks
+			self.pass_badblocks.append({'pass': pass_no, 'stage': self._stage,
+				'read': self.badblocks.read, 'write': self.badblocks.write, 'diff': self.badblocks.diff
+			})
+		if self._stage == 'wipe':	# make the pass durable, the next pass reads from the device
+			self._target.sync()
+			self._target.drop_cache(0, self._target.size)
+		self._progress(self._target.size, final=True)
+		self._echo(f'Process took {format_time(time() - self._start_time)}')
+		if self._skipped:
+			self._echo(f'Skipped {self._skipped} bytes in holes of sparse file')
+		for msg in self._notes:
+			self._echo(msg)
+		return True
+
+	def run(self):
+		'''Execute task, return True when done or False if aborted'''
+		self._target = Target(self.path, writeable=self.task not in ('verify', 'sample'), direct=self.direct)
+		self._pipeline = None
+		self._random = None
+		self.digest = None
+		self._params = {'task': self.task, 'value': self.value, 'blocksize': self.blocksize, 'size': self._target.size, 'fused': self.fused, 'discard': self.discard}
+		resume = self._journal.load(self._params) if self._journal else None	# last checkpoint of an aborted run
+		try:
+			if not self.transfersize:
+				self.transfersize = self._round(self.TRANSFERSIZE) if self.task == 'sample' else self._autotune()
+			self._rewritten = list()	# [offset, size] of the runs the selective pass has overwritten
+			self._plain_discard = False	# discarded pages may read differently later, so all pages are verified
+			self.pass_badblocks = list()
+			if resume:
+				self.pass_badblocks = resume.get('passes', list())
+				self.badblocks.ranges = BadRanges(resume.get('ranges'))
+				self._rewritten = resume.get('rewritten', list())
+				self._plain_discard = resume.get('plain_discard', False)
+				self._echo(f'Found checkpoint of aborted run from {strftime("%Y-%m-%d %H:%M:%S", localtime(resume["time"]))}')
+			self._chunk = bytes([self.value]) * self.transfersize	# reference to compare whole chunks
+			self._reference = memoryview(aligned_buffer(self.transfersize))	# to write aligned slices without copying
+			self._reference[:] = self._chunk
+			self._pipeline = Pipeline(self.queuedepth, self.transfersize)
+			wipe_passes = list()
+			if self.discard:
+				if self.value == 0:
+					wipe_passes.append((self._discard,))
+				else:
+					self._warning('discarded ranges read as zeros, discard is skipped as the value is not 0')
+			if self.task == 'selective':
+				wipe_passes.append((self._wipe_selective,))
+			elif self.task == 'extra':
+				self._random = RandomStream()
+				self._echo(f'Pass 1 writes a random stream generated by {self._random.workers} thread(s)')
+				wipe_passes.append((self._wipe_all, True))
+			if self.fused:	# last pass writes the value and verifies
+				wipe_passes.append((self._wipe_fused,))
+			elif self.task in ('full', 'extra'):
+				wipe_passes.append((self._wipe_all,))
+			passes = len(wipe_passes) + (not self.fused)
+			for pass_no, wipe_pass in enumerate(wipe_passes, start=1):
+				if resume and pass_no < resume['pass_no']:
+					continue
+				if not self._pass(pass_no, passes, *wipe_pass, resume=resume if resume and pass_no == resume['pass_no'] else None):
+					return False
+				if self.badblocks.total > 0 and pass_no < passes:
+					self._warning(f'finished wiping pass {pass_no} but found {self.badblocks}')
+			if self.task == 'sample':
+				verify_pass = self._verify_sampled
+			elif self.task == 'selective' and not self.fullverify and not self._plain_discard:
+				verify_pass = self._verify_rewritten
+			else:
+				if self.task == 'selective' and self._plain_discard and not self.fullverify:
+					self._echo('Discarded pages of the device may read differently later, all pages are verified')
+				verify_pass = self._verify
+			if not self.fused and not self._pass(passes, passes, verify_pass,
+				resume = resume if resume and resume['pass_no'] == passes else None
+			):
+				return False
+		except BadBlocksError:	# a run aborted because of bad blocks is not resumed
+			if self._journal:
+				self._journal.remove()
+			raise
+		finally:
+			if self._pipeline:
+				self._pipeline.shutdown()
+			if self._random:
+				self._random.shutdown()
+			self.reads = self._target.reads
+			self.writes = self._target.writes
+			self.read_bytes = self._target.read_bytes
+			self.written_bytes = self._target.written_bytes
+			self._target.close()
+		if self._journal:
+			self._journal.remove()
+		if self.badblocks.total > 0:
+			self._warning(f'all done but found {self.badblocks}')
+		else:
+			self._echo('Verification was successful, all done')
+		return True
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import builtins
+from sys import modules
+from time import perf_counter
+from threading import local
+
+class StartupProfiler:
+	'''Measure times of imports and phases while the application starts'''
+
+	def __init__(self, enabled=False):
+		'''Start clock and hook into imports if enabled'''
+		self.enabled = enabled
+		self._start_time = perf_counter()
+		self._phases = list()	# (phase, seconds since start)
+		self._imports = list()	# (depth, module, seconds including nested imports)
+		self._local = local()	# import depth per thread
+		self._import = builtins.__import__
+		if enabled:
+			builtins.__import__ = self._timed_import
+
+	def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+		'''Replacement of __import__, only modules that are not loaded yet are measured'''
+		module = name
+		if level:	# relative import, resolve name for the report
+			package = (globals or dict()).get('__package__') or ''
+			module = f'{package}.{name}' if name else package
+		if module in modules:
+			return self._import(name, globals, locals, fromlist, level)
+		depth = getattr(self._local, 'depth', 0)
+		self._local.depth = depth + 1
+		start_time = perf_counter()
+		try:
+			return self._import(name, globals, locals, fromlist, level)
+		finally:
+			self._local.depth = depth
+			self._imports.append((depth, module, perf_counter() - start_time))
+
+	def mark(self, phase):
+		'''Note that a phase is reached'''
+		if self.enabled:
+			self._phases.append((phase, perf_counter() - self._start_time))
+
+	def stop(self):
+		'''Stop measuring imports and phases'''
+		self.enabled = False
+		if builtins.__import__ == self._timed_import:
+			builtins.__import__ = self._import
+
+	def report(self):
+		'''Return timings as text, nested imports are indented and listed before the importing module'''
+		lines = ['Phases (ms since start):']
+		lines.extend(f'{seconds*1000:10.1f}  {phase}' for phase, seconds in self._phases)
+		lines.append('Imports (ms including nested imports):')
+		lines.extend(f'{seconds*1000:10.1f}  {"  " * depth}{name}' for depth, name, seconds in self._imports)
+		return '\n'.join(lines)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from os import makedirs, symlink, makedev
+from os.path import join as path_join, dirname
+from stat import S_IFBLK, S_IFDIR, S_IFREG
+from types import SimpleNamespace
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from unittest.mock import patch
+import sys
+sys.path.insert(0, dirname(dirname(__file__)))
+import classes_wiper
+from classes_wiper import SysfsDrives
+
+DISKS = {	# name: (major, minor, device path, partitions)
+	'sda': (8, 0, 'pci0000:00/0000:00:17.0/ata1/host0/target0:0:0/0:0:0:0', ('sda1', 'sda2')),
+	'sdb': (8, 16, 'pci0000:00/0000:00:17.0/ata2/host1/target1:0:0/1:0:0:0', ('sdb1',)),
+	'sdc': (8, 32, 'pci0000:00/0000:00:17.0/ata3/host2/target2:0:0/2:0:0:0', ('sdc1',)),
+	'sdd': (8, 48, 'pci0000:00/0000:00:17.0/ata4/host3/target3:0:0/3:0:0:0', ('sdd1',)),
+	'sde': (8, 64, 'pci0000:00/0000:00:14.0/usb2/2-1/2-1:1.0/host4/target4:0:0/4:0:0:0', ('sde1',)),
+	'sdf': (8, 80, 'pci0000:00/0000:00:14.0/usb2/2-2/2-2:1.0/host5/target5:0:0/5:0:0:0', ('sdf1',))
+}
+VIRTUAL = {	# name: (major, minor, slaves)
+	'dm-0': (253, 0, ('sdb1',)),
+	'md0': (9, 0, ('sdc1', 'sdd1'))
+}
+MOUNTS = '''/dev/root / ext4 rw 0 0
+proc /proc proc rw 0 0
+/dev/mapper/vg-home /home ext4 rw 0 0
+/dev/md0 /srv/raid\\040data xfs rw 0 0
+'''
+SWAPS = '''Filename Type Size Used Priority
+/dev/sde1 partition 1000 0 -2
+/swapfile file 1000 0 -3
+'''
+FILES = {	# path in the fake tree: (mode, device that is or holds it)
+	'': (S_IFDIR, makedev(8, 2)),	# root file system on sda2, mounted from /dev/root
+	'swapfile': (S_IFREG, makedev(8, 2)),
+	'home': (S_IFDIR, makedev(253, 0)),
+	'srv/raid data': (S_IFDIR, makedev(9, 0)),
+	'dev/sde1': (S_IFBLK, makedev(8, 65))
+}
+
+class TestSysfsDrives(TestCase):
+	'''Fake sysfs tree with root on /dev/root, dm and md devices and swap'''
+
+	def setUp(self):
+		'''Build the tree'''
+		self._tmp = TemporaryDirectory()
+		self.root = self._tmp.name
+		partitions = list()
+		for name, (major, minor, path, parts) in DISKS.items():
+			sys_path = f'sys/devices/{path}/block/{name}'
+			self._link(f'sys/block/{name}', f'/{sys_path}')
+			self._link(f'sys/dev/block/{major}:{minor}', f'/{sys_path}')
+			self._write(f'{sys_path}/device/model', f'Model {name}\n')
+			partitions.append(f'{major} {minor} 1000000 {name}')
+			for no, part in enumerate(parts, start=1):
+				self._write(f'{sys_path}/{part}/partition', f'{no}\n')
+				self._link(f'sys/dev/block/{major}:{minor + no}', f'/{sys_path}/{part}')
+				partitions.append(f'{major} {minor + no} 500000 {part}')
+		for name, (major, minor, slaves) in VIRTUAL.items():
+			sys_path = f'sys/devices/virtual/block/{name}'
+			self._link(f'sys/block/{name}', f'/{sys_path}')
+			self._link(f'sys/dev/block/{major}:{minor}', f'/{sys_path}')
+			for slave in slaves:
+				disk = slave.rstrip('0123456789')
+				self._link(f'{sys_path}/slaves/{slave}', f'/sys/devices/{DISKS[disk][2]}/block/{disk}/{slave}')
+			partitions.append(f'{major} {minor} 500000 {name}')
+		self._link('dev/mapper/vg-home', '/dev/dm-0')
+		self._write('proc/partitions', 'major minor  #blocks  name\n\n' + '\n'.join(partitions) + '\n')
+		self._write('proc/mounts', MOUNTS)
+		self._write('proc/swaps', SWAPS)
+		self._stat = patch.object(classes_wiper, 'stat', self._fake_stat)
+		self._stat.start()
+		self.drives = SysfsDrives(self.root)
+
+	def tearDown(self):
+		'''Remove the tree'''
+		self._stat.stop()
+		self._tmp.cleanup()
+
+	def _path(self, path):
+		'''Path inside the fake tree'''
+		return path_join(self.root, path)
+
+	def _write(self, path, text):
+		'''Write file and create its directory'''
+		makedirs(dirname(self._path(path)), exist_ok=True)
+		with open(self._path(path), 'w', encoding='utf-8') as fh:
+			fh.write(text)
+
+	def _link(self, path, target):
+		'''Create symlink to absolute path inside the fake tree'''
+		makedirs(dirname(self._path(path)), exist_ok=True)
+		makedirs(self._path(target.lstrip('/')), exist_ok=True)
+		symlink(self._path(target.lstrip('/')), self._path(path))
+
+	def _fake_stat(self, path):
+		'''Device numbers of the mount points, the swap file and the swap partition'''
+		relative = path[len(self.root):].strip('/')
+		if relative not in FILES:
+			raise FileNotFoundError(path)
+		mode, device = FILES[relative]
+		return SimpleNamespace(st_mode=mode, st_dev=0 if mode == S_IFBLK else device, st_rdev=device if mode == S_IFBLK else 0)
+
+	def test_dev_root(self):
+		'''Root file system from /dev/root protects its disk'''
+		self.assertEqual(self.drives.snapshot().mounts['/dev/sda2'], {'/', '[SWAP]'})
+		self.assertNotIn('/dev/root', self.drives.snapshot().mounts)
+		self.assertEqual(self.drives.get_volume_of('/etc'), '/dev/sda2')
+		self.assertEqual(self.drives.get_parent_of(self.drives.get_volume_of('/')), '/dev/sda')
+
+	def test_slaves(self):
+		'''Device mapper and raid devices protect the disks below them'''
+		mounts = self.drives.snapshot().mounts
+		self.assertEqual(mounts['/dev/sdb1'], {'/home'})
+		self.assertEqual(mounts['/dev/sdc1'], {'/srv/raid data'})
+		self.assertEqual(mounts['/dev/sdd1'], {'/srv/raid data'})
+
+	def test_system_ids(self):
+		'''Every disk with a mounted partition or swap is forbidden, others are not'''
+		ids = self.drives.get_system_ids()
+		for disk in ('sda', 'sdb', 'sdc', 'sdd', 'sde'):
+			self.assertIn(f'/dev/{disk}', ids)
+		self.assertIn('/dev/sde1', ids)
+		self.assertNotIn('/dev/sdf', ids)
+		self.assertEqual(self.drives.get_forbidden_ids(('/home/user',)), ids)
+
+	def test_inventory(self):
+		'''Only physical disks are listed'''
+		self.assertEqual([drive['DeviceID'] for drive in self.drives.dump()],
+			['/dev/sda', '/dev/sdb', '/dev/sdc', '/dev/sdd', '/dev/sde', '/dev/sdf']
+		)
+		self.assertEqual(self.drives.get_children_of('/dev/sda'), {'/dev/sda1', '/dev/sda2'})
+
+if __name__ == '__main__':
+	main()
@@ -9,12 +9,16 @@ __license__ = 'GPL-3'
 __author__ = 'Markus Thilo'
 __email__ = 'markus.thilomarkus@gmail.com'
 
-from sys import executable as __executable__
-from threading import Thread, Event
-from pythoncom import CoInitialize, CoUninitialize
+import sys
+from sys import executable as __executable__, argv
+from os import getenv
+from startup import StartupProfiler
+__startup__ = StartupProfiler(enabled='--profile-startup' in argv or bool(getenv('WIPER_PROFILE_STARTUP')))
 from pathlib import Path
 from ctypes import windll
 from subprocess import run
+from threading import Thread, Event
+from queue import SimpleQueue, Empty
 from tkinter import Tk, PhotoImage, StringVar, BooleanVar, Checkbutton, Toplevel
 from tkinter.font import nametofont
 from tkinter.ttk import Frame, Label, Entry, Button, Combobox, Treeview
@@ -22,41 +26,58 @@ from tkinter.ttk import Scrollbar, Spinbox, Progressbar
 from tkinter.scrolledtext import ScrolledText
 from tkinter.messagebox import showerror, askokcancel, askyesno, showwarning
 from idlelib.tooltip import Hovertip
-from worker import Wipe
-from classes_wiper import Config, Drives
+from classes_wiper import Config	# worker, engine and wmi are imported when needed
 
-__parent_path__ = Path(__file__).parent if Path(__executable__).stem == 'python' else Path(__executable__).parent
+__parent_path__ = Path(__executable__).parent if getattr(sys, 'frozen', False) or '__compiled__' in globals() else Path(__file__).parent	# frozen or built by nuitka
+__startup__.mark('imports')
 
-class WorkThread(Thread):
-	'''The worker has tu run as thread not to freeze GUI/Tk'''
+class Inventory(Thread):
+	'''Enumerate drives in the background, so the window does not wait for WMI'''
 
-	def __init__(self, target_id, echo, finish):
-		'''Pass arguments to worker'''
-		super().__init__()
-		self._finish = finish
-		self._kill_event = Event()
-		try:
-			self._worker = Wipe(target_id, echo=echo, kill=self._kill_event, finish=self._finish)
-		except Exception as ex:
-			self._finish(ex)
+	INTERVAL = 2	# seconds inbetween refreshes
 
-	def kill(self):
-		'''Kill thread'''
-		self._kill_event.set()
-
-	def kill_is_set(self):
-		'''Return True if kill event is set'''
-		return self._kill_event.is_set()
+	def __init__(self, protect=(), echo=None):
+		'''Drives holding the given paths are forbidden as well as the system drives, errors are passed to echo'''
+		super().__init__(daemon=True)
+		self.drives = None		# Drives with latest snapshot, lookups in the gui do not query WMI
+		self.forbidden_ids = set()
+		self.dump = None		# latest list of drives, None until the first enumeration is done
+		self._protect = protect
+		self._echo = echo
+		self._stop_event = Event()
 
 	def run(self):
-		'''Run thread'''
-		CoInitialize()
+		'''Enumerate drives until stopped, errors would end the thread silently and are passed on'''
 		try:
-			returncode = self._worker.run()
+			self._enumerate()
 		except Exception as ex:
-			returncode = ex
-		CoUninitialize()
-		self._finish(returncode)
+			if self._echo:
+				self._echo(f'{type(ex)}: {ex}')
+
+	def _enumerate(self):
+		'''Refresh drives, WMI objects are only used in this thread'''
+		from pythoncom import CoInitialize, CoUninitialize
+		from classes_wiper import Drives
+		CoInitialize()
+		try:
+			drives = Drives()
+			self.forbidden_ids = drives.get_forbidden_ids(self._protect)
+			self.drives = drives
+			while True:
+				try:
+					drives.snapshot(refresh=True)
+					self.dump = drives.dump()
+				except:
+					pass	# keep last dump
+				__startup__.mark('drives enumerated')
+				if self._stop_event.wait(self.INTERVAL):
+					break
+		finally:
+			CoUninitialize()
+
+	def stop(self):
+		'''Stop refreshing'''
+		self._stop_event.set()
 
 class Gui(Tk):
 	'''GUI look and feel'''
@@ -69,18 +90,15 @@ class Gui(Tk):
 		self._config = Config(__parent_path__ / 'config.json')
 		self._config.application = __application__
 		self._config.version = __version__
-		self._work_thread = None
-		self._drives = Drives()
-		self._target_id = None
-		self._forbidden_ids = self._drives.get_system_ids()	# drives not to selected
-		drive_id = f'{Path(__file__).drive}'	# prevent wiping drive of this application
-		self._forbidden_ids.add(drive_id)
-		if parent_id := self._drives.get_parent_of(drive_id):
-			self._forbidden_ids.add(parent_id)
-		if drive_id := f'{Path().home().drive}':
-			self._forbidden_ids.add(drive_id)
-			if parent_id := self._drives.get_parent_of(drive_id):
-				self._forbidden_ids.add(drive_id)
+		__startup__.mark('config')
+		self._scheduler = None
+		self._target_ids = list()
+		self._messages = SimpleQueue()		# (message, end) from any thread, the inventory might send errors at once
+		self._inventory = Inventory(protect=(__parent_path__, Path.home()),	# prevent wiping drive of this application and home
+			echo = lambda msg: self.echo(self._labels.inventory_error.replace('#', msg))
+		)
+		self._inventory.start()
+		self._forbidden_ids = set()	# drives not to selected, set by inventory
 		self._drive_dump = None	# to check for changes
 		self.title(f'{__application__} v{__version__}')	### define the gui ###
 		for row, weight in enumerate(self._defs.row_weights):
@@ -104,7 +122,7 @@ class Gui(Tk):
 		self._start_text = StringVar(value=self._labels.select_target)	
 		self._start_button = None
 		self._drive_tree = Treeview(self._drive_frame,
-			selectmode = 'browse',
+			selectmode = 'extended',
 			columns = ('Info', 'Size'),
 			show = 'tree'
 		)
@@ -112,9 +130,8 @@ class Gui(Tk):
 		self._drive_tree.column('Info', minwidth=self._info_width, stretch='yes') 
 		self._drive_tree.column('Size', width = self._size_width, stretch='no')
 		self._drive_tree.tag_configure('forbidden', foreground=self._defs.red_fg, background=self._defs.red_bg)
-		self._gen_drive_tree()
 		self._drive_tree.pack(side='left', expand=True, fill='both')
-		self._drive_tree.bind('<Button-1>', self._select_drive)
+		self._drive_tree.bind('<<TreeviewSelect>>', self._select_drive)
 		vsb = Scrollbar(self._drive_frame, orient='vertical', command=self._drive_tree.yview)
 		vsb.pack(side='right', fill='y')
 		self._drive_tree.configure(yscrollcommand=vsb.set)
@@ -200,7 +217,11 @@ class Gui(Tk):
 		self._info_text.configure(state='disabled')
 		self._info_fg = self._info_text.cget('foreground')
 		self._info_bg = self._info_text.cget('background')
-		self._info_newline = True
+		self._info_text.mark_set('progress', '1.0')	# progress lines are shown behind this mark
+		self._info_text.mark_gravity('progress', 'left')
+		self._returncodes = SimpleQueue()	# return codes of finished schedulers
+		self._progress_lines = dict()		# newest progress line of every job
+		self._echo_interval = self._defs.get('echo_interval', 100)	# milliseconds
 		self._shutdown = BooleanVar(value=False)	### shutdown after finish
 		self._shutdown_button = Checkbutton(self,
 			text = self._labels.shutdown,
@@ -221,66 +242,93 @@ class Gui(Tk):
 			msg = self._labels.admin_required.replace('#', __application__)
 			showerror(self._labels.error, msg)
 			raise SystemExit(msg)
-		self._refresh_counter = 0	# to check devices every 2 seconds
 		self._warning_state = 'disabled'	# no warning info
+		__startup__.mark('widgets')
+		self.after_idle(__startup__.mark, 'window shown')
 		self._refresh_loop()	# handle warning and observe drives
+		self._drain_messages()	# show messages of the workers
 
 	def _gen_drive_tree(self):
-		'''Refresh drive tree'''
+		'''Refresh drive tree from the latest inventory'''
+		new_drive_dump = self._inventory.dump
+		if new_drive_dump is None or new_drive_dump is self._drive_dump:
+			return
+		self._forbidden_ids = self._inventory.forbidden_ids
+		first = self._drive_dump is None
+		if first or new_drive_dump != self._drive_dump:
+			self._show_drive_tree(new_drive_dump)
+		self._drive_dump = new_drive_dump	# same object until next refresh, no need to compare again
+		if first:
+			__startup__.mark('drive tree filled')
+			self._report_startup()
+
+	def _report_startup(self):
+		'''Print and save startup timings if profiling is enabled'''
+		if not __startup__.enabled:
+			return
+		__startup__.stop()
+		report = __startup__.report()
+		print(report)
 		try:
-			new_drive_dump = self._drives.dump()
-		except:
-			new_drive_dump = self._drive_dump
-		if new_drive_dump != self._drive_dump:
-			self._drive_dump = new_drive_dump
-			self._drive_tree.delete(*self._drive_tree.get_children())
-			current_ids = set()
-			for drive_dict in self._drive_dump:
-				drv_id = drive_dict['DeviceID']
-				current_ids.add(drv_id)
+			(__parent_path__ / 'startup_profile.txt').write_text(report, encoding='utf-8')
+		except OSError:
+			pass
+
+	def _show_drive_tree(self, drive_dump):
+		'''Show drives in tree'''
+		self._drive_tree.delete(*self._drive_tree.get_children())
+		current_ids = set()
+		for drive_dict in drive_dump:
+			drv_id = drive_dict['DeviceID']
+			current_ids.add(drv_id)
+			infos = list()
+			if drive_dict['Caption']:
+				infos.append(drive_dict['Caption'])
+			if drive_dict['MediaType']:
+				infos.append(drive_dict['MediaType'])
+			if drive_dict['InterfaceType']:
+				infos.append(drive_dict['InterfaceType'])
+			values = (', '.join(infos), drive_dict['Size'] if drive_dict['Size'] else '')
+			if drv_id in self._forbidden_ids:
+				self._drive_tree.insert('', 'end', text=drv_id, values=values, iid=drv_id, open=True, tags='forbidden')
+			else:
+				self._drive_tree.insert('', 'end', text=drv_id, values=values, iid=drv_id, open=True)
+			for part_dict in drive_dict['Partitions']:
+				part_id = part_dict['DeviceID']
+				current_ids.add(part_id)
 				infos = list()
-				if drive_dict['Caption']:
-					infos.append(drive_dict['Caption'])
-				if drive_dict['MediaType']:
-					infos.append(drive_dict['MediaType'])
-				if drive_dict['InterfaceType']:
-					infos.append(drive_dict['InterfaceType'])
-				values = (', '.join(infos), drive_dict['Size'] if drive_dict['Size'] else '')
-				if drv_id in self._forbidden_ids:
-					self._drive_tree.insert('', 'end', text=drv_id, values=values, iid=drv_id, open=True, tags='forbidden')
+				if part_dict['VolumeName']:
+					infos.append(part_dict['VolumeName'])
+				if part_dict['FileSystem']:
+					infos.append(part_dict['FileSystem'])
+				values = (', '.join(infos), part_dict['Size'] if part_dict['Size'] else '')
+				if part_id in self._forbidden_ids:
+					self._drive_tree.insert(drv_id, 'end', text=part_id, values=values, iid=part_id, tags='forbidden')
 				else:
-					self._drive_tree.insert('', 'end', text=drv_id, values=values, iid=drv_id, open=True)
-				for part_dict in drive_dict['Partitions']:
-					part_id = part_dict['DeviceID']
-					current_ids.add(part_id)
-					infos = list()
-					if part_dict['VolumeName']:
-						infos.append(part_dict['VolumeName'])
-					if part_dict['FileSystem']:
-						infos.append(part_dict['FileSystem'])
-					values = (', '.join(infos), part_dict['Size'] if part_dict['Size'] else '')
-					if part_id in self._forbidden_ids:
-						self._drive_tree.insert(drv_id, 'end', text=part_id, values=values, iid=part_id, tags='forbidden')
-					else:
-						self._drive_tree.insert(drv_id, 'end', text=part_id, values=values, iid=part_id)
-			if not self._target_id in current_ids and self._start_button:
-				self._start_text.set(self._labels.select_target)
-				self._start_button.configure(state='disabled')
-				self._target_id = None
+					self._drive_tree.insert(drv_id, 'end', text=part_id, values=values, iid=part_id)
+		if self._target_ids and self._start_button and not set(self._target_ids) <= current_ids:
+			self._start_text.set(self._labels.select_target)
+			self._start_button.configure(state='disabled')
+			self._target_ids = list()
 
 	def _select_drive(self, event):
-		'''Run on double click'''
-		if item := self._drive_tree.identify('item', event.x, event.y):
+		'''Run when selection changes, multiple drives can be selected'''
+		target_ids = list()
+		for item in self._drive_tree.selection():
 			if item in self._forbidden_ids:
 				self._start_text.set(self._labels.select_target)
 				self._start_button.configure(state='disabled')
-				self._target_id = None
+				self._target_ids = list()
 				return
-			self._target_id = self._drives.get_parent_of(item)
-			self._get_task()
-			self._start_button.configure(state='normal')
-			self._info_text.configure(foreground=self._info_fg, background=self._info_bg)
-			self._warning_state = 'stop'
+			if (target_id := self._inventory.drives.get_parent_of(item)) and not target_id in target_ids:
+				target_ids.append(target_id)
+		if not target_ids:
+			return
+		self._target_ids = target_ids
+		self._get_task()
+		self._start_button.configure(state='normal')
+		self._info_text.configure(foreground=self._info_fg, background=self._info_bg)
+		self._warning_state = 'stop'
 
 	def _refresh_loop(self):
 		'''Show flashing warning'''
@@ -297,16 +345,15 @@ class Gui(Tk):
 		elif self._warning_state != 'disabled':
 			self._info_label.configure(text= '', foreground=self._label_fg, background=self._label_bg)
 			self._warning_state = 'disabled'
-		self._refresh_counter += 1
-		if self._refresh_counter > 3:
-			self._refresh_counter = 0
-			self._gen_drive_tree()
+		self._gen_drive_tree()	# cheap, the inventory runs in its own thread
 		self.after(500, self._refresh_loop)
 
 	def _clear_info(self):
 		'''Clear info text'''
+		self._progress_lines = dict()
 		self._info_text.configure(state='normal')
 		self._info_text.delete('1.0', 'end')
+		self._info_text.mark_set('progress', '1.0')
 		self._info_text.configure(state='disabled')
 		self._info_text.configure(foreground=self._info_fg, background=self._info_bg)
 		self._warning_state = 'stop'
@@ -320,11 +367,11 @@ class Gui(Tk):
 		else:
 			self._config.task = task
 		finally:
-			if self._target_id:
-				if self._config.task == 'verify':
-					self._start_text.set(self._labels.verify.replace('#', self._target_id))
+			if self._target_ids:
+				if self._config.task in ('verify', 'sample'):
+					self._start_text.set(self._labels.verify.replace('#', ', '.join(self._target_ids)))
 				else:
-					self._start_text.set(self._labels.wipe.replace('#', self._target_id))
+					self._start_text.set(self._labels.wipe.replace('#', ', '.join(self._target_ids)))
 
 	def _get_value(self):
 		'''Get value'''
@@ -386,7 +433,7 @@ class Gui(Tk):
 		'''Get label and verify if it matches file system restrictions'''
 		if self._config.fs != 'none':
 			try:
-				label = self._drives.check_fs_label(self._label.get(), self._config.fs)
+				label = self._inventory.drives.check_fs_label(self._label.get(), self._config.fs)
 			except Exception as ex:
 				return
 		else:
@@ -395,9 +442,13 @@ class Gui(Tk):
 
 	def _start(self):
 		'''Start wiping'''
-		target = self._target_id
-		if logical := self._drives.get_children_of(self._target_id):
-			target += f' ({", ".join(logical)})'
+		targets = list()
+		for target_id in self._target_ids:
+			if logical := self._inventory.drives.get_children_of(target_id):
+				targets.append(f'{target_id} ({", ".join(logical)})')
+			else:
+				targets.append(target_id)
+		target = '\n'.join(targets)
 		if ex := self._get_task():
 			showerror(title=self._labels.error, message=f'{type(ex)}: {ex}')
 			return
@@ -427,7 +478,7 @@ class Gui(Tk):
 		except:
 			showerror(title=self._labels.error, message=self._labels.start_replace('#', self.config.path))
 			return
-		if self._config.task == 'verify':
+		if self._config.task in ('verify', 'sample'):
 			if self._config.create != 'none' and not askokcancel(
 					title = self._labels.warning,
 					message = self._labels.verify_warning.replace('#', target)
@@ -449,8 +500,11 @@ class Gui(Tk):
 		self._blocksize_box.configure(state='disabled')
 		self._quit_text.set(self._labels.abort)
 		self._clear_info()
-		self._work_thread = WorkThread(self._target_id, self.echo, self.finished)
-		self._work_thread.start()
+		from worker import Scheduler	# imports the engine
+		self._scheduler = Scheduler(self._target_ids, echo=self.echo, finish=self.finished,
+			controllers = self._inventory.drives.get_controllers()
+		)
+		self._scheduler.start()
 
 	def _toggle_shutdown(self):
 		'''Toggle select switch to shutdown after finish'''
@@ -473,17 +527,17 @@ class Gui(Tk):
 		self._blocksize_box.configure(state='normal')
 		self._shutdown.set(False)
 		self._quit_text.set(self._labels.quit)
-		self._target_id = None
-		self._work_thread = None
+		self._target_ids = list()
+		self._scheduler = None
 
 	def _quit_app(self):
 		'''Quit app or ask to abort process'''
-		if self._work_thread:	
-			if self._work_thread.kill_is_set():
+		if self._scheduler:	
+			if self._scheduler.kill_is_set():
 				self._reset()
 			else:
 				if askokcancel(title=self._labels.warning, message=self._labels.abort_warning):
-					self._work_thread.kill() # kill running work thread
+					self._scheduler.kill() # kill running jobs
 				return
 		self._get_value()
 		self._get_blocksize()
@@ -496,6 +550,7 @@ class Gui(Tk):
 			self._config.save()
 		except:
 			pass
+		self._inventory.stop()
 		self.destroy()
 
 	def _enable_warning(self):
@@ -543,18 +598,50 @@ class Gui(Tk):
 		self._shutdown_window.wait_window(self._shutdown_window)
 
 	def echo(self, *args, end=None):
-		'''Write message to info field (ScrolledText)'''
-		msg = ' '.join(f'{arg}' for arg in args)
-		self._info_text.configure(state='normal')
-		if not self._info_newline:
-			self._info_text.delete('end-2l', 'end-1l')
-		self._info_text.insert('end', f'{msg}\n')
-		self._info_text.configure(state='disabled')
-		if self._info_newline:
-			self._info_text.yview('end')
-		self._info_newline = end != '\r'
+		'''Queue message for the info field, can be called from any thread'''
+		self._messages.put((' '.join(f'{arg}' for arg in args), end))
+
+	def _drain_messages(self):
+		'''Show queued messages, only the newest progress line of every job is shown'''
+		lines = list()
+		changed = False
+		while True:
+			try:
+				msg, end = self._messages.get_nowait()
+			except Empty:
+				break
+			key = '' if msg.startswith('...') else msg.split(' ', 1)[0]	# device id prefix of concurrent jobs
+			if end == '\r':
+				self._progress_lines[key] = msg
+			else:
+				lines.append(msg)
+				self._progress_lines.pop(key, None)	# a message replaces the progress line of its job
+				self._progress_lines.pop('', None)
+			changed = True
+		if changed:
+			self._info_text.configure(state='normal')
+			self._info_text.delete('progress', 'end')
+			if lines:
+				self._info_text.insert('end', ''.join(f'{line}\n' for line in lines))
+			self._info_text.mark_set('progress', 'end-1c')
+			if self._progress_lines:
+				self._info_text.insert('end', ''.join(f'{line}\n' for line in self._progress_lines.values()))
+			self._info_text.configure(state='disabled')
+			if lines:
+				self._info_text.yview('end')
+		try:
+			returncode = self._returncodes.get_nowait()
+		except Empty:
+			pass
+		else:
+			self._finished(returncode)
+		self.after(self._echo_interval, self._drain_messages)
 
 	def finished(self, returncode):
+		'''Queue return code, is called from the thread of the last job'''
+		self._returncodes.put(returncode)
+
+	def _finished(self, returncode):
 		'''Run this when worker has finished copy process'''
 		if returncode:
 			if self._shutdown.get():	### Shutdown dialog ###
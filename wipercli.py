@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from argparse import ArgumentParser
+from pathlib import Path
+from json import loads
+from sys import platform, stdout, exit as sys_exit
+from traceback import print_exc
+from worker import Scheduler, __parent_path__
+from classes_wiper import Config, Drives
+from engine import Engine
+if platform == 'win32':
+	from pythoncom import CoInitialize
+else:	# linux wipe stations
+	from classes_wiper import SysfsDrives as Drives
+
+EXIT_SUCCESS = 0	# all drives done
+EXIT_WARNINGS = 1	# done but with warnings, e.g. bad blocks
+EXIT_USAGE = 2		# invalid arguments or targets, same as argparse
+EXIT_ERRORS = 3		# at least one wipe failed
+EXIT_ABORTED = 4	# aborted by user or signal
+
+def exit_code(returncode, labels):
+	'''Map return code of a job to exit code'''
+	if returncode is True:
+		return EXIT_SUCCESS
+	if returncode is None:
+		return EXIT_ABORTED
+	if returncode is False or returncode == labels.warnings_occured:
+		return EXIT_WARNINGS
+	return EXIT_ERRORS	# exception or error message
+
+def parse_value(arg):
+	'''Value of a config key given on the command line, JSON or string'''
+	try:
+		return loads(arg)
+	except ValueError:
+		return arg
+
+def main():
+	'''Command line interface'''
+	argparser = ArgumentParser(description='Wipe drives without GUI, exit codes: '
+		f'{EXIT_SUCCESS} = done, {EXIT_WARNINGS} = warnings, {EXIT_USAGE} = invalid arguments, '
+		f'{EXIT_ERRORS} = errors, {EXIT_ABORTED} = aborted'
+	)
+	argparser.add_argument('-c', '--config', type=Path,
+		help='JSON file with keys as in config.json to overwrite the defaults from config.json', metavar='FILE'
+	)
+	argparser.add_argument('-s', '--set', action='append', default=list(),
+		help='Set config key, value is JSON or string, e.g. -s task=full -s maxjobs=4', metavar='KEY=VALUE'
+	)
+	argparser.add_argument('-q', '--quiet', action='store_true',
+		help='Do not show progress lines'
+	)
+	argparser.add_argument('targets', nargs='+',
+		help='Drives to wipe, partitions select the drive they are on'
+	)
+	args = argparser.parse_args()
+	config = Config(__parent_path__ / 'config.json')
+	if args.config:
+		try:
+			config.update(loads(args.config.read_text(encoding='utf-8')))
+		except (OSError, ValueError) as ex:
+			argparser.error(f'unable to read config {args.config}: {ex}')
+	for arg in args.set:
+		key, sep, value = arg.partition('=')
+		if not sep:
+			argparser.error(f'invalid argument for --set: {arg}')
+		config.update({key: parse_value(value)})
+	if config.task not in Engine.TASKS:
+		argparser.error(f'invalid task: {config.task}')
+	labels = Config(__parent_path__ / 'labels.json')
+	if platform == 'win32':
+		CoInitialize()
+	drives = Drives()
+	forbidden_ids = drives.get_forbidden_ids((__parent_path__, Path.home()))	# same drives as in the gui
+	device_ids = list()
+	for target in args.targets:
+		if not (device_id := drives.get_parent_of(target)) or device_id not in drives.snapshot().disks:
+			argparser.error(f'unknown drive: {target}')
+		if target in forbidden_ids or device_id in forbidden_ids:
+			argparser.error(f'refusing to wipe system drive: {target}')
+		if device_id not in device_ids:
+			device_ids.append(device_id)
+	quiet = args.quiet or not stdout.isatty()	# progress lines only on terminals
+	width = 0	# length of the progress line to overwrite
+	def echo(*msg, end='\n'):
+		nonlocal width
+		if end == '\r' and quiet:
+			return
+		first, sep, rest = ' '.join(f'{arg}' for arg in msg).partition('\n')
+		print(first.ljust(width) + sep + rest, end=end, flush=True)	# pad with spaces to clear the progress line
+		width = len(first) if end == '\r' else 0
+	scheduler = Scheduler(device_ids, echo=echo, controllers=drives.get_controllers(), config=config)
+	scheduler.start()
+	try:
+		while not scheduler.wait(1):	# wake up to handle ctrl-c on windows
+			pass
+	except KeyboardInterrupt:
+		scheduler.kill()
+		scheduler.wait()
+		return EXIT_ABORTED
+	codes = list()
+	for job in scheduler.jobs:
+		codes.append(exit_code(job.returncode, labels))
+		if len(scheduler.jobs) > 1:
+			print(f'{job.device_id}: {job.returncode}', flush=True)
+	return max(codes)
+
+if __name__ == '__main__':	# start here when run as application
+	try:
+		returncode = main()
+	except Exception:	# a crash must not look like warnings to scripts
+		print_exc()
+		returncode = EXIT_ERRORS
+	sys_exit(returncode)
@@ -1,108 +1,231 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from sys import executable as __executable__
+import sys
+from sys import executable as __executable__, platform
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 from pathlib import Path
 from time import time, strftime
 from os import getpid
+from re import sub
+from json import dumps
+from hashlib import sha256
+from hmac import new as new_hmac
+from threading import Thread, Event, Lock
 from classes_wiper import Config, Drives, WinPopen
+from engine import Engine, Journal, BadRanges, BadBlocksError
+if platform == 'win32':
+	from pythoncom import CoInitialize, CoUninitialize
+else:	# linux wipe stations
+	from classes_wiper import SysfsDrives as Drives
 
-__parent_path__ = Path(__file__).parent if Path(__executable__).stem == 'python' else Path(__executable__).parent
+__parent_path__ = Path(__executable__).parent if getattr(sys, 'frozen', False) or '__compiled__' in globals() else Path(__file__).parent	# frozen or built by nuitka
+
+class JobLog:
+	'''Log file of one job, records are written by a background thread'''
+
+	def __init__(self, path):
+		'''Open log file and start writer thread'''
+		self.path = path
+		self._file_handler = logging.FileHandler(filename=path, mode='w', encoding='utf-8')
+		self._file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+		queue = SimpleQueue()
+		self.logger = logging.Logger(f'wiper.{path.stem}', level=logging.INFO)	# not registered by logging, so loggers do not pile up
+		self.logger.addHandler(QueueHandler(queue))
+		self._listener = QueueListener(queue, self._file_handler)
+		self._listener.start()
+
+	def close(self):
+		'''Write pending records and close log file, does nothing if already closed'''
+		if self.logger.disabled:
+			return
+		self.logger.disabled = True
+		self._listener.stop()
+		self._file_handler.close()
+
+def purge_logs(dir_path, max_age=604800):
+	'''Delete files in log directory older than max_age seconds (default 7 days)'''
+	now = time()
+	for path in dir_path.iterdir():
+		try:
+			if now - path.stat().st_mtime > max_age:
+				path.unlink()
+		except OSError:
+			pass
 
 class Wipe:
 	'''Wipe disk'''
 
-	def __init__(self, device_id, echo=print, kill=None, finish=None):
-		'''Create object'''
+	def __init__(self, device_id, echo=print, kill=None, finish=None, progress=None, config=None):
+		'''Create object, config.json is read if no Config is given'''
 		self._time = strftime('%Y-%m-%d_%H%M')
 		self._pid = f'{getpid():08x}'
 		self._device_id = device_id 		# \\.\PHYSICALDRIVE\X
 		self._echo = echo					# method to show messages (print or from gui)
 		self._kill = kill					# event to stop wipe process
 		self._finish = finish				# method to call when wipe process is finished
-		self._config = Config(__parent_path__ / 'config.json')
+		self._progress = progress			# method to pass Progress objects of the engine to
+		self._config = config if config else Config(__parent_path__ / 'config.json')
 		self._labels = Config(__parent_path__ / 'labels.json')
 		self._log_dir_path = __parent_path__ / 'logs'	### logging ###
-		if self._log_dir_path.exists():
-			if self._log_dir_path.is_file():
-				self._log_dir_path.unlink()
-				self._log_dir_path.mkdir()
-			else:
-				now = time()	# purge logs older 7 days
-				for path in self._log_dir_path.iterdir():
-					if now - path.stat().st_mtime > 604800:
-						try:
-							path.unlink()
-						except:
-							pass
+		if self._log_dir_path.is_file():
+			self._log_dir_path.unlink()
+		self._log_dir_path.mkdir(exist_ok=True)
+		if self._purge_lock.acquire(blocking=False):	# purge old logs in background, once at a time
+			Thread(target=self._purge_logs, daemon=True).start()
+		self._drive_name = sub(r'\W', '', self._device_id)
+		self._name = f'{self._time}_{self._pid}_{self._drive_name}'	# one log per job and drive
+		self._log_file_path = self._log_dir_path / f'{self._name}_log.txt'
+		self._engine = self._config.get('engine', 'zd-win')
+		self._override = None	# option zd-win cannot handle if the python engine is used instead
+		if self._engine != 'python':
+			if platform != 'win32':	# zd-win runs only on windows
+				self._override = f'platform={platform}'
+			elif self._config.task == 'sample':
+				self._override = 'task=sample'
+			elif self._config.get('fused') and self._config.task in ('full', 'extra'):	# same tasks as in the engine
+				self._override = 'fused=true'
+		if self._engine == 'python' or self._override:	# wipe in process
+			self._cmd = None
 		else:
-			self._log_dir_path.mkdir()
-		self._log_file_path = self._log_dir_path / f'{self._time}_{self._pid}_log.txt'
-		formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-		logger = logging.getLogger()
-		logger.setLevel(logging.INFO)
-		log_fh = logging.FileHandler(filename=self._log_file_path, mode='w', encoding='utf-8')
-		log_fh.setFormatter(formatter)
-		logger.addHandler(log_fh)
-		self._cmd = [__parent_path__ / 'zd-win.exe',
-			'-f', self._config.value,
-			'-b', f'{self._config.blocksize}',
-			'-m', f'{self._config.maxbadblocks}',
-			'-r', f'{self._config.maxretries}'
-		]
-		if self._config.task == 'full':
-			self._cmd.append('-a')
-		elif self._config.task  == 'extra':
-			self._cmd.append('-x')
-		elif self._config.task  == 'verify':
-			self._cmd.append('-v')
-		self._cmd.append(self._device_id)
-		self._script_path = self._log_dir_path /  f'{self._time}_{self._pid}_diskpart.txt'	# path to script for diskpart
+			self._cmd = [__parent_path__ / 'zd-win.exe',
+				'-f', self._config.value,
+				'-b', f'{self._config.blocksize}',
+				'-m', f'{self._config.maxbadblocks}',
+				'-r', f'{self._config.maxretries}'
+			]
+			if self._config.task == 'full':
+				self._cmd.append('-a')
+			elif self._config.task  == 'extra':
+				self._cmd.append('-x')
+			elif self._config.task  == 'verify':
+				self._cmd.append('-v')
+			self._cmd.append(self._device_id)
+		self._progress_path = self._log_dir_path / f'{self._name}_progress.jsonl'	# engine progress as json lines
+		self._journal_path = self._log_dir_path / f'{self._drive_name}_journal.json'	# checkpoints, same for every job on the drive
+		self._bad_ranges_path = self._log_dir_path / f'{self._name}_badblocks.json'	# map of bad blocks
+		self._report_path = self._log_dir_path / f'{self._name}_report.json'	# hashed report with digest of the verified data
+		self._script_path = self._log_dir_path /  f'{self._name}_diskpart.txt'	# path to script for diskpart
 		self._warnings = False
+		self._create = self._config.create	# partition table to create, diskpart is only available on windows
+		if platform != 'win32':
+			self._create = 'none'
+
+	_purge_lock = Lock()	# shared by all jobs
+
+	def _purge_logs(self):
+		'''Purge old logs, runs as thread'''
+		try:
+			purge_logs(self._log_dir_path)
+		finally:
+			self._purge_lock.release()
 
 	def run(self):
+		'''Execute wipe process, the log is closed in any case'''
+		self._log = JobLog(self._log_file_path)
+		self._logger = self._log.logger
+		try:
+			return self._run()
+		finally:
+			self._close_log()
+
+	def _run(self):
 		'''Execute copy process (or simulation)'''
 		self._drives = Drives()
 		msg = self._labels.log_head.replace('#', f'{self._config.application} v{self._config.version}')
-		for attr, info in self._drives.get_drive_info(self._device_id).items():
+		drive_info = self._drives.get_drive_info(self._device_id) or dict()
+		for attr, info in drive_info.items():
 			if info:
 				msg += f'\n{attr}: {info}'
 		msg += '\n'
-		logging.info(msg)
-		self._echo(self._labels.executing.replace('#', f'{self._cmd[0].name} {" ".join(self._cmd[1:])}'))
+		self._logger.info(msg)
 		self._old_part_ids = self._drives.get_children_of(self._device_id)
-		zd_proc = WinPopen(self._cmd)	### zd-win ###
-		for line in zd_proc.stdout:
-			msg = line.strip()
-			if msg.startswith('...'):
-				self._echo(msg, end='\r')
-			elif msg.startswith('Warning:'):
-				self._warning(msg)
-			elif msg == '':
-				self._echo('')
-			else:
-				self._info(msg)
-			if self._check_kill_signal():
-				zd_proc.terminate()
-				zd_proc.wait()
-				return
-		if stderr := zd_proc.stderr.read().strip():
-			if stderr.startswith('Error: found bad blocks:'):
-				msg = self._labels.bad_blocks_error.replace('#', stderr)
-				if self._config.task == 'verify' and self._config.create == 'none':
-					self._warning(msg)
+		if self._override:
+			self._info(self._labels.python_engine.replace('#', self._override))
+		if self._create != self._config.create:
+			self._info(self._labels.no_diskpart.replace('#', self._config.create))
+		if self._cmd:
+			self._echo(self._labels.executing.replace('#', f'{self._cmd[0].name} {" ".join(self._cmd[1:])}'))
+			zd_proc = WinPopen(self._cmd)	### zd-win ###
+			for line in zd_proc.stdout:
+				self._handle_output(line)
+				if self._check_kill_signal():
+					zd_proc.terminate()
+					zd_proc.wait()
+					return
+			if stderr := zd_proc.stderr.read().strip():
+				if stderr.startswith('Error: found bad blocks:'):
+					if returncode := self._bad_blocks_error(stderr):
+						return returncode
 				else:
-					self._error(ChildProcessError(msg))
-			else:
-				self._error(ChildProcessError(self._labels.zd_error.replace('#', stderr)))
-		if  self._config.create != 'none':
-			if self._config.create != 'none' and self._config.fs:	### diskpart ###
+					return self._error(ChildProcessError(self._labels.zd_error.replace('#', stderr)))
+			self._write_report(drive_info)
+		else:
+			workers = self._config.get('readworkers', dict())
+			if isinstance(workers, dict):	# by bus, interface or media type of the drive
+				workers = (workers.get(drive_info.get('BusType')) or workers.get(drive_info.get('InterfaceType'))
+					or workers.get(drive_info.get('MediaType')) or 1
+				)
+			self._echo(self._labels.executing.replace('#',
+				f'python engine, task={self._config.task}, value={self._config.value}, '
+				f'blocksize={self._config.blocksize}, maxbadblocks={self._config.maxbadblocks}, '
+				f'maxretries={self._config.maxretries}, transfersize={self._config.get("transfersize", Engine.TRANSFERSIZE)}, '
+				f'queuedepth={self._config.get("queuedepth", Engine.QUEUEDEPTH)}, workers={workers}, target={self._device_id}'
+			))
+			identity = {'DeviceID': self._device_id,
+				'Model': drive_info.get('Model'),
+				'SerialNumber': drive_info.get('SerialNumber'),
+				'Size': drive_info.get('Size')
+			}
+			engine = Engine(self._device_id,	### in process engine ###
+				task = self._config.task,
+				value = int(self._config.value, 16),
+				blocksize = self._config.blocksize,
+				maxbadblocks = self._config.maxbadblocks,
+				maxretries = self._config.maxretries,
+				transfersize = self._config.get('transfersize', Engine.TRANSFERSIZE),
+				queuedepth = self._config.get('queuedepth', Engine.QUEUEDEPTH),
+				confidence = self._config.get('confidence', 0.99),
+				dirtyfraction = self._config.get('dirtyfraction', 0.0001),
+				skipahead = self._config.get('skipahead', True),
+				digest = self._config.get('digest', 'sha256') or None,
+				fullverify = self._config.get('fullverify', False),
+				fused = self._config.get('fused', False),
+				discard = self._config.get('discard', False),
+				direct = self._config.get('direct', True),
+				workers = workers,
+				echo = self._info,
+				warning = self._warning,
+				progress = self._on_progress,
+				kill = self._kill,
+				journal = Journal(self._journal_path, identity) if self._config.get('resume', True) and drive_info else None,
+				known = self._load_bad_ranges(identity)
+			)
+			bad_blocks_error = None
+			try:
+				with self._progress_path.open('w', encoding='utf-8') as self._progress_fh:
+					done = engine.run()
+			except BadBlocksError as ex:
+				done = True
+				bad_blocks_error = f'{ex}'
+			except OSError as ex:
+				return self._error(ex)
+			self._save_bad_ranges(engine.badblocks.ranges, identity)
+			if not done:
+				self._check_kill_signal()
+				return
+			self._write_report(drive_info, engine)
+			if bad_blocks_error and (returncode := self._bad_blocks_error(bad_blocks_error)):
+				return returncode
+		if  self._create != 'none':
+			if self._create != 'none' and self._config.fs:	### diskpart ###
 				new_volume_id = None	# do not assign drive
-				if self._config.create == 'none' or self._config.fs == 'none':
+				if self._create == 'none' or self._config.fs == 'none':
 					self._info(self._labels.running_diskpart)
 					self._drives.diskpart(self._device_id, self._script_path,
-						pt = None if self._config.create == 'none' else self._config.create,
+						pt = None if self._create == 'none' else self._create,
 						fs = None,
 						echo = self._echo
 					)
@@ -130,7 +253,7 @@ class Wipe:
 							else:
 								self._info(self._labels.running_diskpart_again)
 							self._drives.diskpart(self._device_id, self._script_path,
-								pt = self._config.create,
+								pt = self._create,
 								fs = self._config.fs,
 								label = self._config.label,
 								letter = volume_id.rstrip(':'),
@@ -144,7 +267,7 @@ class Wipe:
 					else:
 						self._info(self._labels.running_diskpart)
 						self._drives.diskpart(self._device_id, self._script_path,
-							pt = self._config.create,
+							pt = self._create,
 							fs = self._config.fs,
 							label = self._config.label,
 							echo = self._echo
@@ -153,40 +276,126 @@ class Wipe:
 			if new_volume_id:
 				self._info(self._labels.finished)
 				self._echo(self._labels.drive_ready.replace('#', f'{new_volume_id}'))
-				logging.shutdown()
+				self._close_log()
 				drive_path = Path(new_volume_id)
 				try:
 					drive_path.joinpath(f'{self._time}_wiper_log.txt').write_bytes(self._log_file_path.read_bytes())
+					if self._report_path.exists():
+						drive_path.joinpath(f'{self._time}_wiper_report.json').write_bytes(self._report_path.read_bytes())
 				except:
 					self._echo(self._labels.warning_log.replace('#', f'{drive_path}'))
 					self._warnings = True
 				return not self._warnings
 			else:
-				self._warning(self._labels.warning_assign.replace('#', f'{drive_path}'))
+				self._warning(self._labels.warning_assign.replace('#', self._device_id))
 			self._warnings = True
 		self._info(self._labels.finished)
 		if self._warnings:
 			self._warning(self._labels.warnings_occured)
+			returncode = self._labels.warnings_occured
 		else:
 			returncode = True
-		logging.shutdown()
+		self._close_log()
 		return returncode
 
+	def _handle_output(self, line):
+		'''Handle line of output from zd-win or engine'''
+		msg = line.strip()
+		if msg.startswith('...'):
+			self._echo(msg, end='\r')
+		elif msg.startswith('Warning:'):
+			self._warning(msg)
+		elif msg == '':
+			self._echo('')
+		else:
+			self._info(msg)
+
+	def _on_progress(self, progress):
+		'''Show, store and pass on progress of the engine'''
+		self._echo(f'{progress}', end='\n' if progress.final else '\r')	# final progress stays visible
+		print(progress.json(), file=self._progress_fh, flush=True)
+		if self._progress:
+			self._progress(progress)
+
+	def _load_bad_ranges(self, identity):
+		'''Load latest map of bad blocks of this drive from the logs'''
+		for path in sorted(self._log_dir_path.glob(f'*_{self._drive_name}_badblocks.json'), reverse=True):
+			if (ranges := BadRanges.load(path, identity)) is not None:
+				self._info(self._labels.bad_ranges_loaded.replace('#', path.name))
+				return ranges
+
+	def _save_bad_ranges(self, ranges, identity):
+		'''Save map of bad blocks next to the log'''
+		if not ranges:
+			return
+		self._logger.info(f'{ranges}')
+		try:
+			ranges.save(self._bad_ranges_path, self._config.blocksize, identity=identity)
+		except OSError as ex:
+			self._warning(ex)
+			self._warnings = True
+			return
+		self._info(self._labels.bad_ranges_saved.replace('#', self._bad_ranges_path.name))
+
+	def _write_report(self, drive_info, engine=None):
+		'''Write report with drive info, bad blocks and digest of the verified data, hashed and signed if a key is given'''
+		report = {
+			'application': f'{self._config.application} v{self._config.version}',
+			'time': strftime('%Y-%m-%d %H:%M:%S'),
+			'drive': drive_info,
+			'task': self._config.task,
+			'value': self._config.value,
+			'blocksize': self._config.blocksize,
+			'engine': 'python' if engine else 'zd-win',
+			'badblocks': {	# sum of all passes, failures of a pass must not be hidden by a later pass
+				'read': sum(counters['read'] for counters in engine.pass_badblocks),
+				'write': sum(counters['write'] for counters in engine.pass_badblocks),
+				'diff': sum(counters['diff'] for counters in engine.pass_badblocks),
+				'passes': engine.pass_badblocks,
+				'ranges': engine.badblocks.ranges.as_list()
+			} if engine else None,	# zd-win only reports bad blocks in its output
+			'digest': engine.digest if engine else None
+		}
+		data = dumps(report, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')	# canonical form to hash
+		report['sha256'] = sha256(data).hexdigest()
+		if key := self._config.get('reportkey'):
+			report['hmac_sha256'] = new_hmac(key.encode('utf-8'), data, 'sha256').hexdigest()
+		try:
+			self._report_path.write_text(dumps(report, indent=2, default=str), encoding='utf-8')
+		except OSError as ex:
+			self._warning(ex)
+			self._warnings = True
+			return
+		self._info(self._labels.report_saved.replace('#', self._report_path.name))
+
+	def _bad_blocks_error(self, msg):
+		'''Handle too many bad blocks'''
+		msg = self._labels.bad_blocks_error.replace('#', msg)
+		if self._config.task in ('verify', 'sample') and self._create == 'none':
+			self._warning(msg)
+			self._warnings = True
+		else:
+			return self._error(ChildProcessError(msg))
+
+	def _close_log(self):
+		'''Close log file of this job'''
+		self._log.close()
+
 	def _info(self, msg):
 		'''Log info and echo message'''
-		logging.info(msg)
+		self._logger.info(msg)
 		self._echo(msg)
 
 	def _warning(self, msg):
 		'''Log and echo warning'''
-		logging.warning(msg)
-		self._echo( f'{self._labels.warning}: msg')
+		self._logger.warning(msg)
+		self._echo( f'{self._labels.warning}: {msg}')
 
 	def _error(self, msg):
 		'''Log and echo error'''
-		logging.error(msg)
-		logging.shutdown()
-		returncode = f'{self._labels.error}: msg'
+		self._logger.error(msg)
+		self._close_log()
+		returncode = f'{self._labels.error}: {msg}'
 		self._echo(returncode)
 		return returncode
 
@@ -194,6 +403,131 @@ class Wipe:
 		'''Check if kill signal is set'''
 		if self._kill and self._kill.is_set():
 			self._info(self._labels.aborting_by_user)
-			logging.shutdown()
+			self._close_log()
+			return True
+		return False
+
+class Job(Thread):
+	'''Run wipe process of one drive as thread'''
+
+	def __init__(self, device_id, echo=print, finish=None, progress=None, config=None):
+		'''Pass arguments to worker'''
+		super().__init__()
+		self.device_id = device_id
+		self.returncode = None
+		self._echo = echo
+		self._progress = progress
+		self._config = config
+		self._finish = finish	# method to call with this job when finished
+		self._kill_event = Event()
+
+	def kill(self):
+		'''Kill job'''
+		self._kill_event.set()
+
+	def run(self):
+		'''Run thread'''
+		if platform == 'win32':
+			CoInitialize()
+		try:
+			self.returncode = Wipe(self.device_id, echo=self._echo, kill=self._kill_event, progress=self._progress, config=self._config).run()
+		except Exception as ex:
+			self.returncode = ex
+		if platform == 'win32':
+			CoUninitialize()
+		if self._finish:
+			self._finish(self)
+
+class Scheduler:
+	'''Wipe multiple drives concurrently with limited number of jobs'''
+
+	def __init__(self, device_ids, echo=print, finish=None, controllers=None, progress=None, config=None):
+		'''Create jobs, controllers is dict device id: (interface type, controller id)'''
+		self._config = config if config else Config(__parent_path__ / 'config.json')
+		self._maxjobs = self._config.get('maxjobs', 0)	# 0 = no limit
+		self._controller_jobs = self._config.get('controllerjobs', dict())	# interface type: max. jobs per controller
+		self._controllers = controllers if controllers else dict()
+		self._finish = finish	# method to call when all jobs are finished
+		self._kill_event = Event()
+		self._done_event = Event()	# set when all jobs are finished
+		self._lock = Lock()
+		self.jobs = list()
+		for device_id in device_ids:
+			if len(device_ids) > 1:	# show which drive the message comes from
+				job_echo = lambda *args, end=None, device_id=device_id: echo(f'{device_id}:', *args, end=end)
+			else:
+				job_echo = echo
+			self.jobs.append(Job(device_id, echo=job_echo, finish=self._job_finished, progress=progress, config=config))
+		self._queued = list(self.jobs)
+		self._running = list()
+
+	def _can_start(self, job):
+		'''Check limits'''
+		if self._maxjobs and len(self._running) >= self._maxjobs:
+			return False
+		if not (controller := self._controllers.get(job.device_id)):
+			return True
+		if not (limit := self._controller_jobs.get(controller[0])):
 			return True
-		return False
\ No newline at end of file
+		return sum(1 for running in self._running if self._controllers.get(running.device_id) == controller) < limit
+
+	def _dispatch(self):
+		'''Start queued jobs as far as limits allow'''
+		for job in list(self._queued):
+			if self._can_start(job):
+				self._queued.remove(job)
+				self._running.append(job)
+				job.start()
+
+	def _job_finished(self, job):
+		'''Start next jobs, call finish method after the last one'''
+		with self._lock:
+			self._running.remove(job)
+			if self._kill_event.is_set():
+				self._queued.clear()
+			self._dispatch()
+			if self._running or self._queued:
+				return
+		self._done_event.set()
+		if self._finish:
+			self._finish(self.returncode())
+
+	def returncode(self):
+		'''Combine return codes of all jobs, first exception or warnings or True if everything went well'''
+		if len(self.jobs) == 1:
+			return self.jobs[0].returncode
+		warnings = list()
+		for job in self.jobs:
+			if isinstance(job.returncode, Exception):
+				return job.returncode
+			if isinstance(job.returncode, str):
+				warnings.append(f'{job.device_id}: {job.returncode}')
+		if warnings:
+			return '\n'.join(warnings)
+		return all(job.returncode is True for job in self.jobs) or None
+
+	def start(self):
+		'''Start jobs'''
+		with self._lock:
+			self._dispatch()
+
+	def kill(self):
+		'''Kill all jobs, queued jobs will not start'''
+		with self._lock:
+			self._kill_event.set()
+			self._queued.clear()
+			for job in self._running:
+				job.kill()
+			if self._running:
+				return
+		self._done_event.set()
+		if self._finish:
+			self._finish(None)
+
+	def wait(self, timeout=None):
+		'''Wait until all jobs are finished, return False on timeout'''
+		return self._done_event.wait(timeout)
+
+	def kill_is_set(self):
+		'''Return True if kill event is set'''
+		return self._kill_event.is_set()
\ No newline at end of file